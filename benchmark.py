@@ -0,0 +1,235 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+import requests
+
+from glm_api import GLMAPI
+from hedging import HedgePolicy
+from instructions import RHETORIC_INSTRUCTION, RHETORIC_SYSTEM, SEGMENTATION_INSTRUCTION, SEGMENTATION_SYSTEM
+from mock_server import MockGLMServer
+from polling import BatchPollScheduler
+from templates import TemplateCache
+from utils import save_json_file
+
+MODES = ("batch", "async", "http")
+
+# 各模式的轮询接口，用于统计轮询次数
+POLL_ENDPOINTS = {
+    "batch": "GET /batches/{id}",
+    "async": "GET /async-result/{id}",
+    "http": None,
+}
+
+
+def make_dataset(size: int, seed: int = 0) -> List[dict]:
+    """生成修辞识别与分词各半、长度随机的合成测试数据"""
+    rng = random.Random(seed)
+    chars = "春风又绿江南岸明月何时照我还大漠孤烟直长河落日圆"
+    data = []
+    for i in range(size):
+        sentence = "".join(rng.choice(chars) for _ in range(rng.randint(8, 80)))
+        if i % 2:
+            data.append({"system": RHETORIC_SYSTEM, "instruction": RHETORIC_INSTRUCTION,
+                         "input": f"句子：{sentence}\n判断："})
+        else:
+            data.append({"system": SEGMENTATION_SYSTEM, "instruction": SEGMENTATION_INSTRUCTION,
+                         "input": f"句子：{sentence}\n分词："})
+    return data
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def _serve(server_kwargs: dict, port_queue):
+    server = MockGLMServer(**server_kwargs)
+    port_queue.put(server.httpd.server_address[1])
+    server.httpd.serve_forever()
+
+
+@contextlib.contextmanager
+def mock_server_process(**server_kwargs):
+    """在子进程中运行模拟服务，避免服务端线程占用GIL和内存统计干扰被测客户端，返回服务地址"""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(server_kwargs, port_queue), daemon=True)
+    process.start()
+    try:
+        yield f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+    finally:
+        process.terminate()
+        process.join()
+
+
+def run_mode(mode: str, data: List[dict], api_base: str, batch_poll_delay: float = 1.0, quiet: bool = True,
+             hedge: Optional[float] = None, hedge_budget: float = 0.05, baseline_seconds: Optional[float] = None) -> Dict:
+    """
+    用指定模式对模拟服务跑一次推理，返回吞吐、延迟、轮询次数和峰值内存
+
+    延迟分位数取自服务端记录的观测耗时（见MockGLMServer），峰值内存为tracemalloc统计的客户端Python内存。
+    hedge为分位数时启用请求对冲（仅async/http模式），结果中附带对冲统计，
+    传入baseline_seconds（同一数据不启用对冲时的耗时）时对冲统计中包含总耗时降幅。
+    """
+    hedging = HedgePolicy(hedge, hedge_budget) if hedge is not None else None
+    client = GLMAPI(api_key="mock-key", api_base=api_base, hedging=hedging)
+    # 模拟服务的Batch在数秒内完成，按比例缩短轮询间隔
+    client.batch_poller = BatchPollScheduler(min_delay=batch_poll_delay, max_delay=batch_poll_delay * 60)
+    process = {
+        "batch": lambda: client.batch_process(infer_data=data, description="benchmark"),
+        "async": lambda: client.async_process(infer_data=data),
+        "http": lambda: client.http_process(infer_data=data),
+    }[mode]
+
+    requests.post(f"{api_base}/_reset")
+    tracemalloc.start()
+    start = time.time()
+    try:
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(devnull) if quiet else contextlib.nullcontext():
+                results = process()
+        seconds = time.time() - start
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        client.close()
+    stats = requests.get(f"{api_base}/_stats").json()
+
+    latencies = stats["latencies"]
+    poll_endpoint = POLL_ENDPOINTS[mode]
+    return {
+        "mode": mode,
+        "hedge": hedge,
+        "items": len(data),
+        "seconds": round(seconds, 3),
+        "items_per_sec": round(len(data) / seconds, 2) if seconds > 0 else 0.0,
+        "failed": sum(not result.ok for result in results),
+        "p50": round(_percentile(latencies, 0.5), 3),
+        "p99": round(_percentile(latencies, 0.99), 3),
+        "poll_calls": stats["calls"].get(poll_endpoint, 0) if poll_endpoint else 0,
+        "api_calls": sum(stats["calls"].values()) - 1,  # 不含/_reset
+        "throttled": stats["throttled"],
+        "peak_concurrency": stats["peak_concurrency"],
+        "peak_memory_mb": round(peak_memory / 2 ** 20, 2),
+        "hedging": hedging.stats(baseline_seconds) if hedging is not None else None,
+    }
+
+
+def run_benchmark(modes=MODES, sizes=(100, 1000), seed: int = 0, batch_poll_delay: float = 1.0,
+                  quiet: bool = True, hedge: Optional[float] = None, hedge_budget: float = 0.05,
+                  **server_kwargs) -> List[Dict]:
+    """
+    对每种推理模式和数据量运行一次基准测试，server_kwargs传给MockGLMServer
+
+    hedge为分位数时async/http模式再各启用请求对冲运行一次，便于对比p99和总耗时。
+    """
+    rows = []
+    with mock_server_process(seed=seed, **server_kwargs) as api_base:
+        for size in sizes:
+            data = make_dataset(size, seed)
+            for mode in modes:
+                hedges = [None, hedge] if hedge is not None and mode != "batch" else [None]
+                baseline = None
+                for mode_hedge in hedges:
+                    row = run_mode(mode, data, api_base, batch_poll_delay, quiet, mode_hedge, hedge_budget, baseline)
+                    print(format_row(row))
+                    rows.append(row)
+                    baseline = row["seconds"]
+    return rows
+
+
+def _encode_per_item(item: dict, model: str, max_tokens: int) -> bytes:
+    """未使用预编译模板时的编码方式：逐条构建messages和请求体并整体序列化"""
+    messages = [
+        {"role": "system", "content": item.get('system', '')},
+        {"role": "user", "content": f"{item.get('instruction', '')}\n\n{item.get('input', '')}"}
+    ]
+    data = {"model": model, "messages": messages, "temperature": 0.6, "max_tokens": max_tokens}
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def encode_benchmark(size: int = 100000, seed: int = 0, model: str = "glm-4-plus", repeat: int = 3) -> Dict:
+    """对比逐条序列化与预编译模板编码HTTP请求体的单条耗时（微秒，取repeat次中的最小值）"""
+    data = make_dataset(size, seed)
+    templates = TemplateCache()
+
+    def timed(encode) -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for item in data:
+                encode(item)
+            best = min(best, time.perf_counter() - start)
+        return best / size * 1e6
+
+    per_item = timed(lambda item: _encode_per_item(item, model, 1024))
+    compiled = timed(lambda item: templates.get(model, item).encode_body(item.get('input', ''), temperature=0.6, max_tokens=1024))
+    return {
+        "items": size,
+        "per_item_us": round(per_item, 3),
+        "compiled_us": round(compiled, 3),
+        "speedup": round(per_item / compiled, 2),
+    }
+
+
+_COLUMNS = ("mode", "hedge", "items", "seconds", "items_per_sec", "failed", "p50", "p99", "poll_calls", "api_calls",
+            "throttled", "peak_concurrency", "peak_memory_mb")
+
+
+def format_row(row: Dict) -> str:
+    line = "  ".join(f"{column}={row[column]}" for column in _COLUMNS)
+    return f"{line}  hedging={row['hedging']}" if row.get("hedging") else line
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="使用本地模拟服务对batch/async/http三种推理模式做基准测试")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-median", type=float, default=0.5)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=int, default=0)
+    parser.add_argument("--batch-turnaround", type=float, default=5.0)
+    parser.add_argument("--batch-poll-delay", type=float, default=1.0)
+    parser.add_argument("--straggler-rate", type=float, default=0.0, help="模拟服务中慢请求的比例")
+    parser.add_argument("--straggler-factor", type=float, default=10.0, help="慢请求的耗时倍数")
+    parser.add_argument("--hedge", type=float, metavar="QUANTILE", help="async/http模式再启用请求对冲各运行一次")
+    parser.add_argument("--hedge-budget", type=float, default=0.05)
+    parser.add_argument("--output", help="将结果保存为JSON文件")
+    parser.add_argument("--verbose", action="store_true", help="输出GLMAPI的运行日志")
+    parser.add_argument("--encode", action="store_true", help="只运行请求体编码的微基准测试")
+    args = parser.parse_args()
+
+    if args.encode:
+        for size in args.sizes:
+            print(encode_benchmark(size, args.seed))
+    else:
+        rows = run_benchmark(
+            modes=args.modes,
+            sizes=args.sizes,
+            seed=args.seed,
+            batch_poll_delay=args.batch_poll_delay,
+            quiet=not args.verbose,
+            hedge=args.hedge,
+            hedge_budget=args.hedge_budget,
+            latency_median=args.latency_median,
+            latency_sigma=args.latency_sigma,
+            failure_rate=args.failure_rate,
+            throttle_rate=args.throttle_rate,
+            max_concurrency=args.max_concurrency,
+            batch_turnaround=args.batch_turnaround,
+            straggler_rate=args.straggler_rate,
+            straggler_factor=args.straggler_factor,
+        )
+        if args.output:
+            save_json_file(rows, args.output)
@@ -0,0 +1,149 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+
+def request_params_key(params: dict) -> bytes:
+    """请求参数（temperature、max_tokens等）按键排序后的编码，与模板前缀摘要和input一起计算缓存键"""
+    return json.dumps(params, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+class ResponseCache:
+    """
+    基于SQLite的持久化响应缓存
+
+    以请求内容的sha256（见CompiledTemplate.request_key）为键保存模型输出，支持按条目数、总字节数和存活时间淘汰（按最近访问时间LRU），
+    并统计命中/未命中次数。可在多线程中共享同一实例。
+    """
+
+    _QUERY_CHUNK = 500  # 单条SQL中IN查询的最大参数个数
+
+    def __init__(self, path: str = "saves/response_cache.sqlite", max_entries: int = None,
+                 max_bytes: int = None, max_age: float = None):
+        """
+        Args:
+            path: 缓存数据库路径
+            max_entries: 最大条目数，超出时淘汰最久未访问的条目
+            max_bytes: 响应内容总字节数上限
+            max_age: 条目最大存活秒数，按写入时间计算
+        """
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed)")
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key: str) -> Optional[str]:
+        """查询单个缓存键，未命中返回None"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """批量查询缓存，返回命中的 {key: response}，同时更新访问时间"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        now = time.time()
+        min_created = now - self.max_age if self.max_age else None
+        with self._lock:
+            for start in range(0, len(keys), self._QUERY_CHUNK):
+                chunk = keys[start:start + self._QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                sql = f"SELECT key, response, created FROM responses WHERE key IN ({placeholders})"
+                for key, response, created in self._conn.execute(sql, chunk):
+                    if min_created is None or created >= min_created:
+                        found[key] = response
+            if found:
+                self._conn.executemany(
+                    "UPDATE responses SET accessed = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, key: str, response: str):
+        """写入单条缓存"""
+        self.put_many({key: response})
+
+    def put_many(self, entries: Dict[str, str]):
+        """批量写入缓存"""
+        if not entries:
+            return
+        now = time.time()
+        rows = [(key, response, len(response.encode("utf-8")), now, now) for key, response in entries.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def evict(self, max_entries: int = None, max_bytes: int = None, max_age: float = None) -> int:
+        """按存活时间、条目数和总字节数淘汰缓存，参数缺省时使用构造时的配置，返回删除的条目数"""
+        max_entries = max_entries if max_entries is not None else self.max_entries
+        max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+        max_age = max_age if max_age is not None else self.max_age
+        removed = 0
+        with self._lock:
+            if max_age is not None:
+                cur = self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - max_age,))
+                removed += cur.rowcount
+            if max_entries is not None:
+                cur = self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (max_entries,)
+                )
+                removed += cur.rowcount
+            if max_bytes is not None:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > max_bytes:
+                    stale = []
+                    for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC"):
+                        if total <= max_bytes:
+                            break
+                        stale.append((key,))
+                        total -= size
+                    self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                    removed += len(stale)
+            self._conn.commit()
+        return removed
+
+    def stats(self) -> dict:
+        """返回命中统计与缓存占用"""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        """执行淘汰并关闭数据库连接"""
+        self.evict()
+        with self._lock:
+            self._conn.close()
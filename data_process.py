@@ -1,40 +1,158 @@
 import os
-from typing import Dict, List, Any
-from utils import load_json_file, save_json_file
+from typing import Dict, Iterable, Iterator, List, Any
+from utils import load_json_file, save_json_file, iter_json_array_file, iter_jsonl_file, JsonlWriter
 from instructions import RHETORIC_INSTRUCTION, RHETORIC_SYSTEM, SEGMENTATION_INSTRUCTION, SEGMENTATION_SYSTEM
 
 
-def generate_dataset_from_raw(raw_data: List[Dict], system_prompt: str, instruction: str, input_processor: callable, output_processor: callable = None, include_output: bool = True) -> List[Dict]:
-    dataset = []
-    
+class PromptTemplate:
+    """同一数据集所有记录共享的system和instruction"""
+    __slots__ = ("system", "instruction")
+
+    def __init__(self, system: str, instruction: str):
+        self.system = system
+        self.instruction = instruction
+
+
+class DatasetRecord:
+    """
+    紧凑的数据集记录
+
+    system和instruction通过共享的PromptTemplate引用，不在每条记录中重复保存；
+    支持 record["input"] / record.get("system") 等dict式访问，可直接传给GLMAPI的各推理接口。
+    """
+    __slots__ = ("template", "input", "output", "raw_data")
+
+    def __init__(self, template: PromptTemplate, input: str, output: str, raw_data: Any):
+        self.template = template
+        self.input = input
+        self.output = output
+        self.raw_data = raw_data
+
+    def __getitem__(self, key: str):
+        if key == "system":
+            return self.template.system
+        if key == "instruction":
+            return self.template.instruction
+        if key == "history":
+            return []
+        if key in self.__slots__[1:]:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> Dict:
+        """转换为完整的dict格式（与generate_dataset_from_raw的输出一致）"""
+        return {
+            "system": self.template.system,
+            "instruction": self.template.instruction,
+            "input": self.input,
+            "output": self.output,
+            "history": [],
+            "raw_data": self.raw_data
+        }
+
+
+def iter_dataset_from_raw(raw_data: Iterable[Dict], system_prompt: str, instruction: str, input_processor: callable, output_processor: callable = None, include_output: bool = True) -> Iterator[DatasetRecord]:
+    """按需逐条生成数据集记录，所有记录共享同一个PromptTemplate"""
+    template = PromptTemplate(system_prompt, instruction)
     for item in raw_data:
-        input_str = input_processor(item)
-        
         output_str = ""
         if include_output and output_processor:
             output_str = output_processor(item)
+        yield DatasetRecord(template, input_processor(item), output_str, item)
 
-        dataset.append({
-            "system": system_prompt,
-            "instruction": instruction,
-            "input": input_str,
-            "output": output_str,
-            "history": [],
-            "raw_data": item
-        })
-    
-    return dataset
+
+def generate_dataset_from_raw(raw_data: List[Dict], system_prompt: str, instruction: str, input_processor: callable, output_processor: callable = None, include_output: bool = True) -> List[Dict]:
+    records = iter_dataset_from_raw(raw_data, system_prompt, instruction, input_processor, output_processor, include_output)
+    return [record.to_dict() for record in records]
 
 
-def generate_rhetoric_dataset(dataset_path="rhetoric_data", output_path="rhetoric_data"):
-    """修辞识别数据集生成"""
+def save_compact_dataset(records: Iterable[DatasetRecord], path: str) -> int:
+    """
+    流式写入紧凑格式数据集（JSONL）：首行为共享的 {"template": {"system", "instruction"}}，
+    之后每行一条 {"input", "output", "raw_data"}。返回写入的记录数。
+    """
+    count = 0
+    with JsonlWriter(path) as writer:
+        for record in records:
+            if count == 0:
+                writer.write({"template": {"system": record.template.system, "instruction": record.template.instruction}})
+            writer.write({"input": record.input, "output": record.output, "raw_data": record.raw_data})
+            count += 1
+    print(f"Successfully saved data to {path}")
+    return count
+
+
+def iter_compact_dataset(path: str) -> Iterator[DatasetRecord]:
+    """逐条读取紧凑格式数据集"""
+    rows = iter_jsonl_file(path)
+    header = next(rows, None)
+    if header is None:
+        return
+    template = PromptTemplate(header["template"]["system"], header["template"]["instruction"])
+    for row in rows:
+        yield DatasetRecord(template, row["input"], row["output"], row["raw_data"])
+
+
+def iter_dataset(path: str) -> Iterator:
+    """逐条读取数据集，.jsonl为紧凑格式（DatasetRecord），否则为JSON数组格式（dict）"""
+    if path.endswith(".jsonl"):
+        return iter_compact_dataset(path)
+    return iter_json_array_file(path)
+
+
+def load_dataset(path: str) -> List:
+    """读取完整数据集，支持紧凑格式（.jsonl）和JSON数组格式（.json）"""
+    if path.endswith(".jsonl"):
+        return list(iter_compact_dataset(path))
+    return load_json_file(path)
+
+
+def _generate_splits(dataset_path: str, output_path: str, system_prompt: str, instruction: str,
+                     input_processor: callable, output_processor: callable, compact: bool):
+    """生成train/test两个划分，返回 (train路径, test路径, train条数, test条数)"""
+    paths, counts = [], []
+    for split, include_output in [("train", True), ("test", False)]:
+        raw_path = os.path.join(dataset_path, f"{split}.json")
+        if compact:
+            # 流式读取原始数据并逐条写出，内存占用与数据集大小无关
+            out_path = os.path.join(output_path, f"{split}_for_llm.jsonl")
+            records = iter_dataset_from_raw(
+                raw_data=iter_json_array_file(raw_path),
+                system_prompt=system_prompt,
+                instruction=instruction,
+                input_processor=input_processor,
+                output_processor=output_processor,
+                include_output=include_output
+            )
+            counts.append(save_compact_dataset(records, out_path))
+        else:
+            out_path = os.path.join(output_path, f"{split}_for_llm.json")
+            dataset = generate_dataset_from_raw(
+                raw_data=load_json_file(raw_path),
+                system_prompt=system_prompt,
+                instruction=instruction,
+                input_processor=input_processor,
+                output_processor=output_processor,
+                include_output=include_output
+            )
+            save_json_file(dataset, out_path)
+            counts.append(len(dataset))
+        paths.append(out_path)
+    return paths[0], paths[1], counts[0], counts[1]
+
+
+def generate_rhetoric_dataset(dataset_path="rhetoric_data", output_path="rhetoric_data", compact=False):
+    """修辞识别数据集生成，compact为True时流式生成紧凑格式（*_for_llm.jsonl）"""
     for fname in ["train.json", "test.json"]:
         assert os.path.exists(os.path.join(dataset_path, fname)), f"缺少{fname}文件"
 
     os.makedirs(output_path, exist_ok=True)
-    
-    raw_data_train = load_json_file(os.path.join(dataset_path, "train.json"))
-    raw_data_test = load_json_file(os.path.join(dataset_path, "test.json"))
 
     def process_rhetoric_input(item):
         sentence = item.get('sentence', '')
@@ -49,39 +167,21 @@ def generate_rhetoric_dataset(dataset_path="rhetoric_data", output_path="rhetori
         else:
             return "是，该句含有修辞手法。"
     
-    train_dataset = generate_dataset_from_raw(
-        raw_data=raw_data_train,
-        system_prompt=RHETORIC_SYSTEM,
-        instruction=RHETORIC_INSTRUCTION,
-        input_processor=process_rhetoric_input,
-        output_processor=process_rhetoric_output,
-        include_output=True
-    )
-    test_dataset = generate_dataset_from_raw(
-        raw_data=raw_data_test,
-        system_prompt=RHETORIC_SYSTEM,
-        instruction=RHETORIC_INSTRUCTION,
-        input_processor=process_rhetoric_input,
-        output_processor=process_rhetoric_output,
-        include_output=False
+    train_path, test_path, n_train, n_test = _generate_splits(
+        dataset_path, output_path, RHETORIC_SYSTEM, RHETORIC_INSTRUCTION,
+        process_rhetoric_input, process_rhetoric_output, compact
     )
-    
-    save_json_file(train_dataset, os.path.join(output_path, "train_for_llm.json"))
-    save_json_file(test_dataset, os.path.join(output_path, "test_for_llm.json"))
 
-    print(f"修辞识别数据集已生成，共{len(train_dataset)}条训练数据和{len(test_dataset)}条测试数据，保存到: {output_path}")
-    return 
+    print(f"修辞识别数据集已生成，共{n_train}条训练数据和{n_test}条测试数据，保存到: {output_path}")
+    return train_path, test_path
 
 
-def genrate_segment_dataset(dataset_path="segment_data", output_path="segment_data"):
-    """分词数据集生成"""
+def genrate_segment_dataset(dataset_path="segment_data", output_path="segment_data", compact=False):
+    """分词数据集生成，compact为True时流式生成紧凑格式（*_for_llm.jsonl）"""
     for fname in ["train.json", "test.json"]:
         assert os.path.exists(os.path.join(dataset_path, fname)), f"缺少{fname}文件"
 
     os.makedirs(output_path, exist_ok=True)
-    
-    raw_data_train = load_json_file(os.path.join(dataset_path, "train.json"))
-    raw_data_test = load_json_file(os.path.join(dataset_path, "test.json"))
 
     def process_segment_input(item):
         sentence = item.get('sentence', '')
@@ -90,25 +190,10 @@ def genrate_segment_dataset(dataset_path="segment_data", output_path="segment_da
     def process_segment_output(item):
         return item.get('segmentation', '').strip() or ""
     
-    train_dataset = generate_dataset_from_raw(
-        raw_data=raw_data_train,
-        system_prompt=SEGMENTATION_SYSTEM,
-        instruction=SEGMENTATION_INSTRUCTION,
-        input_processor=process_segment_input,
-        output_processor=process_segment_output,
-        include_output=True
+    train_path, test_path, n_train, n_test = _generate_splits(
+        dataset_path, output_path, SEGMENTATION_SYSTEM, SEGMENTATION_INSTRUCTION,
+        process_segment_input, process_segment_output, compact
     )
-    test_dataset = generate_dataset_from_raw(
-        raw_data=raw_data_test,
-        system_prompt=SEGMENTATION_SYSTEM,
-        instruction=SEGMENTATION_INSTRUCTION,
-        input_processor=process_segment_input,
-        output_processor=process_segment_output,
-        include_output=False
-    )
-    
-    save_json_file(train_dataset, os.path.join(output_path, "train_for_llm.json"))
-    save_json_file(test_dataset, os.path.join(output_path, "test_for_llm.json"))
-    print(f"分词数据集已生成，共{len(train_dataset)}条训练数据和{len(test_dataset)}条测试数据，保存到: {output_path}")
-    return os.path.join(output_path, "train_for_llm.json"), os.path.join(output_path, "test_for_llm.json")
 
+    print(f"分词数据集已生成，共{n_train}条训练数据和{n_test}条测试数据，保存到: {output_path}")
+    return train_path, test_path
@@ -0,0 +1,265 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from results_store import ResultsStore
+from scheduling import TASK_RHETORIC, TASK_SEGMENTATION, detect_task
+from streaming import RHETORIC_LABELS
+from utils import iter_json_array_file, json_loads
+
+INVALID_LABEL = "无效"  # 回答无法判断或推理失败
+
+# 分词span编码为 记录号<<42 | 起始偏移<<21 | 结束偏移，要求单句不超过2^21个字符、每批不超过2^21条
+_OFFSET_BITS = 21
+_RECORD_SHIFT = 2 * _OFFSET_BITS
+_MAX_BATCH_SIZE = 1 << _OFFSET_BITS
+
+
+def rhetoric_label(text: str) -> Optional[str]:
+    """从修辞识别回答中取出“是/否”标签，无法判断时返回None"""
+    text = text.strip()
+    for label in RHETORIC_LABELS:
+        if text.startswith(label):
+            return label
+    return None
+
+
+def gold_answer(record: dict, task: Optional[str] = None) -> Optional[str]:
+    """由原始数据得到标准答案：修辞识别为“是/否”标签，分词为空格分隔的分词结果"""
+    raw_data = record.get("raw_data") or {}
+    task = task or detect_task(record)
+    if task == TASK_RHETORIC:
+        rhetoric_type = raw_data.get("type", "").strip()
+        return "否" if rhetoric_type in ("", "无转义") else "是"
+    if task == TASK_SEGMENTATION:
+        return raw_data.get("segmentation", "").strip()
+    return None
+
+
+# str.split()视为空白的码位查找表（U+3000之后没有空白字符，更大的码位都映射到最后一个False）
+_SPACE_TABLE = np.array([chr(code).isspace() for code in range(0x3001)] + [False])
+_RECORD_SEPARATOR = "\0"
+
+
+def segmentation_spans(texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    把一批空格分隔的分词结果转换为字符偏移span
+
+    每个词对应 [起始, 结束) 偏移（按去掉空白后的字符计），返回 (编码后的span数组, 每条的词数)。
+    整批文本以\0连接后按UTF-32码位一次性切分，不逐词循环。
+    """
+    codes = np.frombuffer(_RECORD_SEPARATOR.join(texts).encode("utf-32-le"), dtype=np.uint32)
+    separator = codes == 0
+    is_word = ~(separator | _SPACE_TABLE[np.minimum(codes, len(_SPACE_TABLE) - 1)])
+    edges = np.diff(np.concatenate(([0], is_word.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    # chars_before[p]为位置p之前的词字符数
+    chars_before = np.concatenate(([0], np.cumsum(is_word, dtype=np.int32))).astype(np.int64)
+    separators = np.flatnonzero(separator)
+    record_ids = np.searchsorted(separators, starts)
+    base = chars_before[np.concatenate(([0], separators + 1))][record_ids]
+    spans = (record_ids << _RECORD_SHIFT) | ((chars_before[starts] - base) << _OFFSET_BITS) | (chars_before[ends] - base)
+    return spans, np.bincount(record_ids, minlength=len(texts))
+
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    return np.divide(numerator, denominator, out=np.zeros(len(numerator)), where=denominator > 0)
+
+
+class EvalCounts:
+    """
+    可累加的评估计数，分批或分进程计算后合并
+
+    分词累计micro的TP/预测词数/标准词数和macro的逐条P/R/F1之和，修辞识别累计混淆矩阵
+    （行为标准答案“是/否”，列为预测“是/否/无效”）。
+    """
+
+    def __init__(self):
+        self.totals: Dict[str, int] = {}
+        self.failed: Dict[str, int] = {}
+        self.seg_tp = self.seg_pred = self.seg_gold = 0
+        self.seg_exact = 0
+        self.seg_macro = np.zeros(3)  # 逐条precision、recall、f1之和
+        self.rhetoric_confusion = np.zeros((len(RHETORIC_LABELS), len(RHETORIC_LABELS) + 1), dtype=np.int64)
+
+    def merge(self, other: "EvalCounts") -> "EvalCounts":
+        for name in ("totals", "failed"):
+            mine = getattr(self, name)
+            for task, count in getattr(other, name).items():
+                mine[task] = mine.get(task, 0) + count
+        self.seg_tp += other.seg_tp
+        self.seg_pred += other.seg_pred
+        self.seg_gold += other.seg_gold
+        self.seg_exact += other.seg_exact
+        self.seg_macro += other.seg_macro
+        self.rhetoric_confusion += other.rhetoric_confusion
+        return self
+
+    def add_batch(self, records: List[dict]):
+        """评估一批results.json记录"""
+        seg_gold, seg_pred, rh_gold, rh_pred = [], [], [], []
+        tasks: Dict[str, str] = {}  # 同一数据集的instruction相同，按instruction缓存任务类型
+        for record in records:
+            instruction = record.get("instruction", "")
+            task = tasks.get(instruction)
+            if task is None:
+                task = tasks[instruction] = detect_task(record) or "unknown"
+            self.totals[task] = self.totals.get(task, 0) + 1
+            raw_data = record.get("raw_data") or {}
+            failed = raw_data.get("llm_status", "success") != "success"
+            if failed:
+                self.failed[task] = self.failed.get(task, 0) + 1
+            pred = "" if failed else raw_data.get("llm_pred", "")
+            if task == TASK_SEGMENTATION:
+                seg_gold.append(gold_answer(record, task))
+                seg_pred.append(pred)
+            elif task == TASK_RHETORIC:
+                rh_gold.append(gold_answer(record, task))
+                rh_pred.append(rhetoric_label(pred) or INVALID_LABEL)
+        if seg_gold:
+            self._add_segmentation(seg_gold, seg_pred)
+        if rh_gold:
+            self._add_rhetoric(rh_gold, rh_pred)
+
+    def _add_segmentation(self, golds: List[str], preds: List[str]):
+        assert len(golds) < _MAX_BATCH_SIZE, "batch_size过大"
+        gold_spans, gold_counts = segmentation_spans(golds)
+        pred_spans, pred_counts = segmentation_spans(preds)
+        # 同一条记录内的span互不相同，交集即为逐条的正确词
+        common = np.intersect1d(gold_spans, pred_spans, assume_unique=True)
+        tp = np.bincount(common >> _RECORD_SHIFT, minlength=len(golds))
+        self.seg_tp += int(tp.sum())
+        self.seg_pred += int(pred_counts.sum())
+        self.seg_gold += int(gold_counts.sum())
+        precision = _safe_divide(tp, pred_counts)
+        recall = _safe_divide(tp, gold_counts)
+        f1 = _safe_divide(2 * precision * recall, precision + recall)
+        self.seg_macro += (precision.sum(), recall.sum(), f1.sum())
+        # 词边界完全一致的记录再比较字符，两者都一致才算整句正确
+        boundary_match = np.flatnonzero((tp == gold_counts) & (tp == pred_counts))
+        self.seg_exact += sum(golds[i].split() == preds[i].split() for i in boundary_match.tolist())
+
+    def _add_rhetoric(self, golds: List[str], preds: List[str]):
+        columns = RHETORIC_LABELS + (INVALID_LABEL,)
+        gold_codes = np.fromiter((RHETORIC_LABELS.index(g) for g in golds), dtype=np.int64, count=len(golds))
+        pred_codes = np.fromiter((columns.index(p) for p in preds), dtype=np.int64, count=len(preds))
+        self.rhetoric_confusion += np.bincount(gold_codes * len(columns) + pred_codes,
+                                               minlength=self.rhetoric_confusion.size).reshape(self.rhetoric_confusion.shape)
+
+    def summary(self) -> Dict[str, dict]:
+        stats = {}
+        for task, total in self.totals.items():
+            task_stats = {"total": total, "failed": self.failed.get(task, 0)}
+            if task == TASK_SEGMENTATION:
+                precision = self.seg_tp / self.seg_pred if self.seg_pred else 0.0
+                recall = self.seg_tp / self.seg_gold if self.seg_gold else 0.0
+                f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+                macro = self.seg_macro / total
+                task_stats.update(
+                    correct=self.seg_exact,
+                    accuracy=self.seg_exact / total,
+                    micro={"precision": precision, "recall": recall, "f1": f1},
+                    macro={"precision": float(macro[0]), "recall": float(macro[1]), "f1": float(macro[2])},
+                )
+            elif task == TASK_RHETORIC:
+                correct = int(np.trace(self.rhetoric_confusion))
+                task_stats.update(
+                    correct=correct,
+                    accuracy=correct / total,
+                    confusion={
+                        gold: dict(zip(RHETORIC_LABELS + (INVALID_LABEL,), map(int, row)))
+                        for gold, row in zip(RHETORIC_LABELS, self.rhetoric_confusion)
+                    },
+                )
+            stats[task] = task_stats
+        return stats
+
+
+def _evaluate_records(records: Iterable[dict], batch_size: int) -> EvalCounts:
+    counts = EvalCounts()
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return counts
+        counts.add_batch(batch)
+
+
+def _iter_jsonl_range(path: str, start: int, end: int) -> Iterable[Tuple[int, dict]]:
+    """读取JSONL文件中起始位置落在 [start, end) 内的各行，产出 (偏移, 记录)"""
+    with open(path, "rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()  # 跳到start之后的第一个行首
+        while f.tell() < end:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield offset, json_loads(line)
+
+
+def _latest_slots(path: str) -> np.ndarray:
+    """
+    各下标最新一行的偏移+1，格式与ResultsStore的索引相同（0表示没有该下标）
+
+    有索引文件时直接读取，否则顺序扫描数据文件生成。
+    """
+    index_path = path + ResultsStore.INDEX_SUFFIX
+    if os.path.exists(index_path):
+        return np.fromfile(index_path, dtype="<u8", count=os.path.getsize(index_path) // 8)
+    latest = {}
+    for offset, record in _iter_jsonl_range(path, 0, os.path.getsize(path)):
+        if "index" in record:
+            latest[record["index"]] = offset
+    slots = np.zeros(max(latest, default=-1) + 1, dtype="<u8")
+    slots[list(latest)] = np.fromiter(latest.values(), dtype="<u8", count=len(latest)) + 1
+    return slots
+
+
+def _iter_latest_records(path: str, start: int, end: int, slots: Optional[np.ndarray] = None) -> Iterable[dict]:
+    """读取 [start, end) 内的各行，同一下标写入多次时只产出最新一条；slots为None时读取索引文件"""
+    if slots is None:
+        slots = _latest_slots(path)
+    for offset, record in _iter_jsonl_range(path, start, end):
+        index = record.get("index")
+        if index is None or (0 <= index < len(slots) and slots[index] == offset + 1):
+            yield record
+
+
+def _evaluate_jsonl_range(path: str, start: int, end: int, batch_size: int,
+                          slots: Optional[np.ndarray] = None) -> EvalCounts:
+    return _evaluate_records(_iter_latest_records(path, start, end, slots), batch_size)
+
+
+def evaluate_results(results_path: str, workers: int = 1, batch_size: int = 10000) -> Dict[str, dict]:
+    """
+    逐批读取process_inference_results写出的results.json或流水线推理写出的results.jsonl并评估
+
+    - 分词：把标准分词（raw_data.segmentation）和预测转换为字符偏移span集合，计算micro/macro P/R/F1，
+      accuracy为整句分词完全一致的比例
+    - 修辞识别：比较“是/否”标签，给出准确率和混淆矩阵，无法判断的回答计为“无效”
+    推理失败的条目计入total和failed，按预测为空处理。
+    workers大于1时把results.jsonl按字节范围分给多个进程评估（results.json只能单进程顺序读取）。
+    results.jsonl中同一下标写入多次时（如恢复运行后重新写入），只评估最新一条。
+    """
+    if results_path.endswith(".jsonl"):
+        size = os.path.getsize(results_path)
+        # 有索引文件时各进程自行读取，否则扫描一遍得到各下标的最新一行后分发给各进程
+        slots = None if os.path.exists(results_path + ResultsStore.INDEX_SUFFIX) else _latest_slots(results_path)
+        if workers <= 1:
+            return _evaluate_jsonl_range(results_path, 0, size, batch_size, slots).summary()
+        bounds = [size * i // workers for i in range(workers + 1)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = executor.map(_evaluate_jsonl_range, [results_path] * workers, bounds[:-1], bounds[1:],
+                                 [batch_size] * workers, [slots] * workers)
+            counts = EvalCounts()
+            for part in parts:
+                counts.merge(part)
+        return counts.summary()
+    return _evaluate_records(iter_json_array_file(results_path), batch_size).summary()
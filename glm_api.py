@@ -1,62 +1,325 @@
-from zai import ZhipuAiClient
+import asyncio
+import functools
 import time
-import json
 import os
+import re
 import tempfile
-import requests
-from typing import List, Dict
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Dict, Optional, Tuple
+from cache import ResponseCache, request_params_key
+from hedging import HedgePolicy
+from journal import RunJournal
+from metrics import MetricsRecorder, RequestTrace
+from polling import BatchPollScheduler, PollScheduler
+from rate_limit import THROTTLED_MESSAGE, AdaptiveLimiter, is_server_error, is_throttle_error
+from scheduling import TokenBudget
+from packing import pack_items, parse_packed_reply
+from planner import BATCH_UNSUPPORTED_MODELS
+from results import STATUS_TIMEOUT, ItemResult
+from streaming import iter_sse_events
+from templates import CompiledTemplate, TemplateCache
+from utils import json_dumps_bytes, json_loads
+
+if TYPE_CHECKING:
+    import requests
+    from zai import ZhipuAiClient
+
+
+_CUSTOM_ID_PATTERN = re.compile(rb'"custom_id"\s*:\s*"(request-\d+)"')
+
+
+def _batch_index(custom_id, expected_count: int) -> Optional[int]:
+    """custom_id（request-<下标>）对应的请求下标，不合法或超出范围时返回None"""
+    if not isinstance(custom_id, str) or not custom_id.startswith('request-'):
+        return None
+    try:
+        index = int(custom_id[len('request-'):])
+    except ValueError:
+        return None
+    return index if 0 <= index < expected_count else None
+
+
+def _stop_key(stop: Callable) -> Optional[str]:
+    """
+    提前停止条件在请求键中的标识：优先使用stop.cache_key，其次为模块级具名函数的 模块.函数名
+
+    lambda、闭包、functools.partial等无法从名称区分行为的停止条件返回None。
+    """
+    cache_key = getattr(stop, "cache_key", None)
+    if cache_key is not None:
+        return str(cache_key)
+    qualname = getattr(stop, "__qualname__", None)
+    if not qualname or "<" in qualname:
+        return None
+    return f"{getattr(stop, '__module__', None)}.{qualname}"
+
+
+class HTTPCallError(Exception):
+    """HTTP接口返回非200状态码"""
+
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"API调用失败: {status_code}, {text}")
+        self.status_code = status_code
+        # 回复体中的错误码（如限流的1302），用于判断错误类型
+        try:
+            self.code = json_loads(text)["error"]["code"]
+        except Exception:
+            self.code = None
+
 
 class GLMAPI:
-    def __init__(self, api_key="", model='glm-4-plus'):
-        self.client = ZhipuAiClient(api_key=api_key)
+    def __init__(self, api_key="", model='glm-4-plus', api_base="https://open.bigmodel.cn/api/paas/v4",
+                 cache: ResponseCache = None, journal: RunJournal = None, token_budget: TokenBudget = None,
+                 metrics: MetricsRecorder = None, hedging: HedgePolicy = None):
         self.api_key = api_key
+        self.api_base = api_base
         self.model = model
-        self.base_url = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
-        self.batch_max_retries = 48  # 最大重试次数，48次，每次等待30分钟，总计24小时
-        self.async_max_retries = 120  # 异步任务最大重试次数，60次，每次等待1秒，总计120秒
-        self.max_concurrent_tasks = 20  # 最大并发任务数
-        
-    def _create_batch_file(self, infer_data: List[dict]) -> str:
-        """创建batch请求文件"""
-        batch_requests = []
-        for i, item in enumerate(infer_data):
-            system = item.get('system', '')
-            instruction = item.get('instruction', '')
-            input_text = item.get('input', '')
-            
-            # 构建完整的prompt
-            messages = [
-                {"role": "system", "content": system},
-                {"role": "user", "content": f"{instruction}\n\n{input_text}"}
-            ]
-            
-            batch_request = {
-                "custom_id": f"request-{i}",
-                "method": "POST",
-                "url": "/v4/chat/completions",
-                "body": {
-                    "model": self.model,
-                    "messages": messages
-                },
-                "max_tokens": 1024,
-            }
-            batch_requests.append(json.dumps(batch_request, ensure_ascii=False))
-        
-        # 创建临时文件
-        temp_file = tempfile.NamedTemporaryFile(mode='w', suffix='.jsonl', delete=False, encoding='utf-8')
-        temp_file.write('\n'.join(batch_requests))
-        temp_file.close()
-        
-        return temp_file.name
+        self.base_url = f"{api_base.rstrip('/')}/chat/completions"
+        self.batch_timeout = 24 * 3600  # Batch最长等待秒数，总计24小时
+        self.batch_max_requests = 50000  # 单个batch文件的最大请求数
+        self.batch_max_bytes = 100 * 1024 * 1024  # 单个batch文件的最大字节数
+        self.async_timeout = 120  # 单个异步任务最长等待秒数
+        self.poller = PollScheduler()  # 异步任务轮询调度（指数退避+预计完成时间）
+        self.batch_poller = BatchPollScheduler()  # Batch轮询调度（按处理进度估算）
+        # 异步任务和HTTP请求共享的自适应限流器：并发上限在1~64之间按AIMD调整，同时限制请求速率
+        self.limiter = AdaptiveLimiter(initial_concurrency=20, max_concurrency=64)
+        self.throttle_max_retries = 5  # 提交或HTTP请求被限流时的最大重试次数
+        self.http_max_workers = 32  # HTTP并发模式的线程数（实际并发还受limiter限制）
+        self._client = None
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.cache = cache  # 可选的持久化响应缓存，三种推理模式共用
+        self.journal = journal  # 可选的运行日志，用于崩溃后恢复
+        self.token_budget = token_budget  # 可选的按条max_tokens预算，启用后按估算输出长度从长到短发出请求
+        self.metrics = metrics  # 可选的逐条请求指标采集（耗时、轮询次数、token用量、错误分类）
+        self.templates = TemplateCache()  # 按system/instruction预编译的请求模板，三种推理模式共用
+        self.hedging = hedging  # 可选的请求对冲，异步和HTTP模式中耗时超过本次运行分位数的请求再发一份
+
+    @property
+    def client(self) -> "ZhipuAiClient":
+        """智谱SDK客户端（异步和Batch模式使用），首次使用时才导入SDK并创建"""
+        if self._client is None:
+            with self._session_lock:
+                if self._client is None:
+                    from zai import ZhipuAiClient
+                    self._client = ZhipuAiClient(api_key=self.api_key, base_url=self.api_base)
+        return self._client
+
+    def _template(self, item: dict) -> CompiledTemplate:
+        return self.templates.get(self.model, item)
+
+    def _build_messages(self, item: dict) -> List[Dict]:
+        """构建完整的prompt"""
+        return self._template(item).messages(item.get('input', ''))
+
+    def _max_tokens(self, item: dict, default: Optional[int] = None) -> Optional[int]:
+        """单条请求的max_tokens：启用token预算时按估算值，否则为default"""
+        if self.token_budget is None:
+            return default
+        return self.token_budget.estimate(item)
 
-    def batch_process(self, infer_data: List[dict] = None, description: str = '') -> List[str]:
+    def _record_usage(self, max_tokens: Optional[int], usage, finish_reason: Optional[str] = None,
+                      trace: Optional[RequestTrace] = None):
+        """记录一条请求的实际token用量（usage可以是SDK对象或dict）"""
+        if trace is not None:
+            trace.set_usage(usage, finish_reason)
+        if self.token_budget is None or max_tokens is None or usage is None:
+            return
+        if isinstance(usage, dict):
+            completion_tokens = usage.get('completion_tokens')
+        else:
+            completion_tokens = getattr(usage, 'completion_tokens', None)
+        self.token_budget.record(max_tokens, completion_tokens, finish_reason)
 
-        assert self.model != "glm-4.5", "GLM-4.5模型不支持批处理，请使用其他模型"
-        # 创建batch文件
-        batch_file_path = self._create_batch_file(infer_data)
+    def _start_trace(self, mode: str, index: int, keys: Optional[List[str]], enqueued: float) -> Optional[RequestTrace]:
+        """未启用指标采集时返回None，之后的各处记录均跳过"""
+        if self.metrics is None:
+            return None
+        return self.metrics.start(mode, index, keys[index] if keys is not None else None, enqueued)
+
+    def _finish_trace(self, trace: Optional[RequestTrace], result: ItemResult):
+        if trace is not None:
+            self.metrics.finish(trace, result)
+
+    def _ordered_dispatch(self, infer_data: List[dict], keys: Optional[List[str]], dispatch: Callable) -> List[ItemResult]:
+        """启用token预算时按估算输出长度从长到短发出请求，结果仍按输入顺序返回"""
+        if self.token_budget is None:
+            return dispatch(infer_data, keys)
+        order = self.token_budget.order_longest_first(infer_data)
+        ordered_results = dispatch(
+            [infer_data[i] for i in order],
+            [keys[i] for i in order] if keys is not None else None
+        )
+        results = [None] * len(infer_data)
+        for i, result in zip(order, ordered_results):
+            results[i] = result
+        return results
+
+    def _dispatch(self, infer_data: List[dict], dispatch: Callable[[List[dict], Optional[List[str]]], List[ItemResult]],
+                  **params) -> List[ItemResult]:
+        """
+        先查缓存和运行日志并对相同请求去重，只把未完成的唯一请求交给dispatch，结果按输入顺序返回
+
+        params为除model和messages外实际发送的请求参数（如temperature、max_tokens），参与请求键计算。
+        dispatch接收待请求的数据及其请求键（未启用缓存和日志时为None）。
+        """
+        if self.cache is None and self.journal is None:
+            return self._ordered_dispatch(infer_data, None, dispatch)
+
+        total_data = len(infer_data)
+        results = [None] * total_data
+        keys = []
+        # 参数编码按max_tokens取值缓存，每条请求只哈希模板前缀摘要和input，不再构建完整请求体
+        params_keys: Dict[Optional[int], bytes] = {None: request_params_key(params)}
+        for item in infer_data:
+            max_tokens = self._max_tokens(item)
+            params_key = params_keys.get(max_tokens)
+            if params_key is None:
+                params_key = params_keys[max_tokens] = request_params_key({**params, "max_tokens": max_tokens})
+            keys.append(self._template(item).request_key(item.get('input', ''), params_key))
+        done = self.cache.get_many(keys) if self.cache is not None else {}
+        if self.journal is not None:
+            done.update((key, self.journal.results[key]) for key in keys if key in self.journal.results)
+
+        pending: Dict[str, List[int]] = {}  # 请求键 -> 使用该请求的输入下标
+        for i, key in enumerate(keys):
+            if key in done:
+                results[i] = ItemResult.success(done[key], attempts=0)
+            else:
+                pending.setdefault(key, []).append(i)
+
+        n_done = total_data - sum(len(idxs) for idxs in pending.values())
+        print(f"缓存/日志命中 {n_done}/{total_data}，去重后需请求 {len(pending)} 条")
+        if not pending:
+            return results
+
+        fresh = self._ordered_dispatch([infer_data[idxs[0]] for idxs in pending.values()], list(pending), dispatch)
+        new_entries = {}
+        for (key, idxs), result in zip(pending.items(), fresh):
+            # 重复的输入各持有一份结果，之后按条累加attempts时互不影响
+            results[idxs[0]] = result
+            for i in idxs[1:]:
+                results[i] = result.copy()
+            if result.ok:
+                new_entries[key] = result.content
+        if self.cache is not None:
+            self.cache.put_many(new_entries)
+        return results
+
+    def _record_result(self, key: Optional[str], result: ItemResult):
+        """将一条最终结果写入运行日志"""
+        if self.journal is not None and key is not None:
+            self.journal.record_result(key, result.text, failed=not result.ok)
         
+    def _build_batch_request(self, item: dict, custom_id: str) -> bytes:
+        """编码batch文件中的单条请求（一行JSON）"""
+        return self._template(item).encode_batch_line(custom_id, item.get('input', ''), max_tokens=self._max_tokens(item))
+
+    def _create_batch_files(self, infer_data: List[dict]) -> List[Tuple[str, List[int]]]:
+        """
+        流式写入batch请求文件，超过batch_max_requests条或batch_max_bytes字节时自动切分
+
+        每个分片内的custom_id从request-0开始编号，返回 [(文件路径, 分片中各请求对应的输入下标)]。
+        """
+        shards = []
+        temp_file = None
+        indices: List[int] = []
+        size = 0
         try:
-            # 1.上传Batch文件
+            for i, item in enumerate(infer_data):
+                line = self._build_batch_request(item, f"request-{len(indices)}")
+                if temp_file is None or len(indices) >= self.batch_max_requests or size + len(line) > self.batch_max_bytes:
+                    if temp_file is not None:
+                        temp_file.close()
+                    # 创建新的分片文件
+                    temp_file = tempfile.NamedTemporaryFile(mode='wb', suffix='.jsonl', delete=False)
+                    indices = []
+                    size = 0
+                    shards.append((temp_file.name, indices))
+                    line = self._build_batch_request(item, "request-0")
+                temp_file.write(line)
+                indices.append(i)
+                size += len(line)
+        except BaseException:
+            for path, _ in shards:
+                os.unlink(path)
+            raise
+        finally:
+            if temp_file is not None:
+                temp_file.close()
+        return shards
+
+    def batch_process(self, infer_data: List[dict] = None, description: str = '') -> List[ItemResult]:
+
+        assert self.model not in BATCH_UNSUPPORTED_MODELS, f"{self.model}模型不支持批处理，请使用其他模型"
+        return self._dispatch(infer_data, lambda data, keys: self._batch_process(data, keys, description))
+
+    def _batch_process(self, infer_data: List[dict], keys: Optional[List[str]] = None, description: str = '') -> List[ItemResult]:
+        """提交batch任务并等待结果"""
+        started = time.time()
+        results = [None] * len(infer_data)
+        todo = list(range(len(infer_data)))
+        if self.journal is not None:
+            todo = self._resume_batches(keys, results)
+        if not todo:
+            return results
+        todo_data = [infer_data[i] for i in todo]
+        todo_keys = [keys[i] for i in todo] if keys is not None else None
+        traces = [self._start_trace("batch", i, todo_keys, started) for i in range(len(todo))]
+
+        # 1.流式创建并自动切分batch文件
+        shards = self._create_batch_files(todo_data)
+        print(f"共 {len(todo_data)} 条请求，切分为 {len(shards)} 个Batch")
+
+        # 2.并发上传文件并创建Batch
+        def submit(shard_no: int) -> Optional[str]:
+            path, indices = shards[shard_no]
+            shard_keys = [todo_keys[i] for i in indices] if todo_keys is not None else None
+            shard_description = description if description else "批处理任务"
+            if len(shards) > 1:
+                shard_description = f"{shard_description} ({shard_no + 1}/{len(shards)})"
+            batch_id = self._submit_batch_file(path, shard_description, shard_keys)
+            if batch_id is not None and self.metrics is not None:
+                created_at = time.time()
+                for i in indices:
+                    traces[i].submitted = created_at
+            return batch_id
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+                batch_ids = list(executor.map(submit, range(len(shards))))
+        finally:
+            # 清理临时文件
+            for path, _ in shards:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+        # 3.同时轮询所有Batch，按custom_id合并回输入顺序
+        submitted = [(batch_id, indices) for batch_id, (_, indices) in zip(batch_ids, shards) if batch_id is not None]
+        for batch_id, (_, indices) in zip(batch_ids, shards):
+            if batch_id is None:
+                for i in indices:
+                    results[todo[i]] = ItemResult.failure("Tasks failed: 创建Batch失败")
+                    self._finish_trace(traces[i], results[todo[i]])
+        shard_usages = [[None] * len(indices) for _, indices in submitted]
+        shard_results = self._poll_batches([
+            (batch_id, len(indices), usages, [traces[i] for i in indices] if self.metrics is not None else None)
+            for (batch_id, indices), usages in zip(submitted, shard_usages)
+        ])
+        for (batch_id, indices), batch_results, usages in zip(submitted, shard_results, shard_usages):
+            self._record_batch_results(batch_id, [todo_keys[i] for i in indices] if todo_keys is not None else None, batch_results)
+            for i, result, usage in zip(indices, batch_results, usages):
+                results[todo[i]] = result
+                if usage is not None:
+                    self._record_usage(self._max_tokens(todo_data[i]), *usage, traces[i])
+                self._finish_trace(traces[i], result)
+        return results
+
+    def _submit_batch_file(self, batch_file_path: str, description: str, keys: Optional[List[str]] = None) -> Optional[str]:
+        """上传batch文件并创建Batch，返回Batch ID，失败时返回None"""
+        try:
+            # 上传Batch文件
             with open(batch_file_path, "rb") as f:
                 batchFile = self.client.files.create(
                     file=f,
@@ -64,230 +327,671 @@ class GLMAPI:
                 )
             print(f"batch文件id: {batchFile.id}")
             
-            # 2.创建Batch
+            # 创建Batch
             createBatch = self.client.batches.create(
                 input_file_id=batchFile.id,
                 endpoint="/v4/chat/completions",
                 metadata={
-                    "description": description if description else "批处理任务"
+                    "description": description
                 }
             )
-            print(f"创建Batch成功：{createBatch}")
-            
-            # 3.轮询Batch处理结果
-            results = self._poll_batch_results(createBatch.id, len(infer_data))
+        except Exception as e:
+            print(f"创建Batch失败: {str(e)}")
+            return None
+
+        print(f"创建Batch成功：{createBatch}")
+        if self.journal is not None:
+            self.journal.record_batch(createBatch.id, keys)
+        return createBatch.id
+
+    def _poll_batches(self, batches: List[tuple]) -> List[List[ItemResult]]:
+        """并发轮询多个Batch，batches为 [(batch_id, 请求数[, usages[, traces]])]，返回各Batch的结果列表"""
+        if not batches:
+            return []
+        with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+            return list(executor.map(lambda batch: self._poll_batch_results(*batch), batches))
+
+    def _resume_batches(self, keys: List[str], results: List[Optional[ItemResult]]) -> List[int]:
+        """重新轮询运行日志中尚未取回结果的Batch并填入results，返回仍需提交的下标"""
+        position = {key: i for i, key in enumerate(keys)}
+        outstanding = [
+            (batch_id, batch_keys) for batch_id, batch_keys in self.journal.batches.items()
+            if any(key in position for key in batch_keys)
+        ]
+        if outstanding:
+            print(f"恢复轮询Batch: {[batch_id for batch_id, _ in outstanding]}")
+        shard_results = self._poll_batches([(batch_id, len(batch_keys)) for batch_id, batch_keys in outstanding])
+        for (batch_id, batch_keys), batch_results in zip(outstanding, shard_results):
+            self._record_batch_results(batch_id, batch_keys, batch_results)
+            for key, result in zip(batch_keys, batch_results):
+                # 仍超时的Batch继续保留在运行日志中，其中的请求不重新提交
+                if key in position and (result.ok or result.status == STATUS_TIMEOUT):
+                    results[position[key]] = result
+        return [i for i, result in enumerate(results) if result is None]
+
+    def _record_batch_results(self, batch_id: str, keys: Optional[List[str]], results: List[ItemResult]):
+        """将Batch结果写入运行日志并标记该Batch已完成；本地等待超时的Batch仍在服务端处理，不记录，恢复或重试时继续轮询"""
+        if self.journal is None or keys is None:
+            return
+        if any(result.status == STATUS_TIMEOUT for result in results):
+            return
+        for key, result in zip(keys, results):
+            self._record_result(key, result)
+        self.journal.record_batch_done(batch_id)
+
+    def _poll_batch_results(self, batch_id: str, expected_count: int, usages: list = None,
+                            traces: List[RequestTrace] = None) -> List[ItemResult]:
+        """
+        轮询batch结果，根据已处理请求数估算剩余时间决定下次轮询间隔
+
+        传入usages（长度为expected_count的列表）时，按custom_id填入各请求的 (usage, finish_reason)；
+        传入traces时，在返回前为各请求记录完成时刻和均摊到每条请求的轮询次数。
+        """
+        start_time = time.time()
+        attempt = 0
+
+        def finish(results: List[ItemResult], polls: int) -> List[ItemResult]:
+            completed_at = time.time()
+            for result in results:
+                result.latency = completed_at - start_time
+            if traces is not None:
+                for trace in traces:
+                    trace.polls = polls / len(traces)
+                    trace.completed = completed_at
             return results
-            
-        finally:
-            # 清理临时文件
-            if os.path.exists(batch_file_path):
-                os.unlink(batch_file_path)
 
-    def _poll_batch_results(self, batch_id: str, expected_count: int) -> List[str]:
-        """轮询batch结果"""
-        for attempt in range(self.batch_max_retries):
+        while time.time() - start_time < self.batch_timeout:
+            completed = 0
+            elapsed = time.time() - start_time
             try:
                 retrieve = self.client.batches.retrieve(batch_id)
+                self.batch_poller.record_poll()
                 print(f"Batch状态: {retrieve.status}")
                 
                 if retrieve.status == "completed":
-                    # 4.下载batch结果
-                    content = self.client.files.content(retrieve.output_file_id)
-                    
-                    # 创建临时文件保存结果
-                    temp_result_file = tempfile.NamedTemporaryFile(mode='w+', suffix='.jsonl', delete=False, encoding='utf-8')
-                    content.write_to_file(temp_result_file.name)
-                    
-                    # 解析结果
-                    results = self._parse_batch_results(temp_result_file.name, expected_count)
-                    
-                    # 清理临时文件
-                    os.unlink(temp_result_file.name)
-                    
-                    return results
+                    # 4.流式下载并解析batch结果文件和错误文件
+                    results = self._collect_batch_results(retrieve, expected_count, usages)
+                    return finish(results, attempt + 1)
                     
                 elif retrieve.status == "failed":
                     print(f"Batch处理失败: {retrieve}")
-                    return ["Tasks failed"] * expected_count
+                    return finish([ItemResult.failure(f"Tasks failed: Batch状态为{retrieve.status}")
+                                   for _ in range(expected_count)], attempt + 1)
                     
-                else:
-                    print(f"等待Batch完成，当前状态: {retrieve.status}")
-                    time.sleep(1800)  # 等待30分钟后重试
+                counts = getattr(retrieve, "request_counts", None)
+                if counts is not None:
+                    completed = (counts.completed or 0) + (counts.failed or 0)
+                    expected_count = counts.total or expected_count
+                created_at = getattr(retrieve, "created_at", None)
+                if created_at:
+                    # created_at可能以毫秒为单位
+                    created_at = created_at / 1000 if created_at > 1e11 else created_at
+                    elapsed = max(time.time() - created_at, elapsed)
+                print(f"等待Batch完成，当前状态: {retrieve.status}，进度 {completed}/{expected_count}")
                     
             except Exception as e:
                 print(f"轮询batch结果时出错: {str(e)}")
-                time.sleep(secends=1800)  # 等待30分钟后重试
+
+            delay = self.batch_poller.next_delay(elapsed, completed, expected_count, attempt)
+            print(f"{delay:.0f}秒后再次查询Batch状态")
+            time.sleep(delay)
+            attempt += 1
         
         print("Batch处理超时")
-        return ["Tasks failed"] * expected_count
+        return finish([ItemResult.timeout("Tasks timeout") for _ in range(expected_count)], attempt)
     
-    def _parse_batch_results(self, result_file_path: str, expected_count: int) -> List[str]:
-        """解析batch结果文件"""
-        results = [""] * expected_count
-        
-        try:
-            with open(result_file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        result_item = json.loads(line)
-                        custom_id = result_item.get('custom_id', '')
-                        if custom_id.startswith('request-'):
-                            index = int(custom_id.split('-')[1])
-                            if 'response' in result_item and 'body' in result_item['response']:
-                                content = result_item['response']['body']['choices'][0]['message']['content']
-                                results[index] = content.strip()
-                            else:
-                                results[index] = "Tasks failed"
-        except Exception as e:
-            print(f"解析batch结果时出错: {str(e)}")
-            return ["Tasks failed"] * expected_count
-        
+    def _collect_batch_results(self, retrieve, expected_count: int, usages: list = None) -> List[ItemResult]:
+        """
+        合并Batch的结果文件（output_file_id）和错误文件（error_file_id），每个请求得到各自的成功或失败结果
+
+        两个文件都边下载边逐行解析，不落盘；下载中断时已解析的行仍然有效，两个文件中都缺少的请求记为失败。
+        """
+        results: List[Optional[ItemResult]] = [None] * expected_count
+        for file_id in (getattr(retrieve, "output_file_id", None), getattr(retrieve, "error_file_id", None)):
+            if not file_id:
+                continue
+            try:
+                self._parse_batch_results(self._iter_file_lines(file_id), results, usages)
+            except Exception as e:
+                print(f"下载batch结果文件 {file_id} 时出错: {str(e)}")
+        return [result if result is not None else ItemResult.failure("Tasks failed: 结果文件中缺少该请求")
+                for result in results]
+
+    def _iter_file_lines(self, file_id: str, chunk_size: int = 1 << 16) -> Iterator[bytes]:
+        """流式下载文件内容，逐行产出（bytes）"""
+        url = f"{self.api_base.rstrip('/')}/files/{file_id}/content"
+        with self._get_session().get(url, stream=True) as response:
+            if response.status_code != 200:
+                raise HTTPCallError(response.status_code, response.text)
+            yield from response.iter_lines(chunk_size=chunk_size)
+
+    def _parse_batch_results(self, lines: Iterable[bytes], results: List[Optional[ItemResult]],
+                             usages: list = None) -> List[Optional[ItemResult]]:
+        """
+        逐行解析batch结果或错误文件，把各请求的结果按custom_id填入results（已有成功结果的请求不被覆盖）
+
+        单行解析出错只影响该行对应的请求：能从该行识别出custom_id时记为失败，否则留空。
+        """
+        expected_count = len(results)
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            index = None
+            try:
+                result_item = json_loads(line)
+                index = _batch_index(result_item.get('custom_id'), expected_count)
+                if index is None:
+                    continue
+                response = result_item.get('response') or {}
+                body = response.get('body') or {}
+                if response.get('status_code', 200) != 200 or not body.get('choices'):
+                    result = ItemResult.failure(f"Tasks failed: {body.get('error') or result_item.get('error') or response}")
+                else:
+                    choice = body['choices'][0]
+                    result = ItemResult.success(choice['message']['content'].strip())
+                    if usages is not None:
+                        usages[index] = (body.get('usage'), choice.get('finish_reason'))
+            except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+                print(f"解析batch结果第{line_no}行时出错: {str(e)}")
+                if index is None:
+                    match = _CUSTOM_ID_PATTERN.search(line)
+                    index = _batch_index(match.group(1).decode("ascii"), expected_count) if match else None
+                if index is None:
+                    continue
+                result = ItemResult.failure(f"Tasks failed: 无法解析结果行: {str(e)}")
+            if results[index] is None or not results[index].ok:
+                results[index] = result
         return results
     
-    def async_process(self, infer_data: List[dict]) -> List[str]:
-        """异步批处理数据，限制并发数在20以内"""
+    def async_process(self, infer_data: List[dict]) -> List[ItemResult]:
+        """异步处理数据，始终保持limiter允许的并发数个任务在途（同步封装）"""
+        return self._dispatch(infer_data, lambda data, keys: asyncio.run(self._async_process(data, keys)))
+
+    async def _async_process(self, infer_data: List[dict], keys: Optional[List[str]] = None) -> List[ItemResult]:
+        """
+        滑动窗口异步引擎：任一任务完成后立即提交下一个，结果按输入顺序返回
+
+        worker数量为limiter的并发上限，每个任务从提交到取回结果期间占用一个并发名额，
+        因此实际在途任务数随AIMD调整的limiter.concurrency变化。
+        """
+        started = time.time()
         total_data = len(infer_data)
-        results = [""] * total_data
-        total_batches = (total_data + self.max_concurrent_tasks - 1) // self.max_concurrent_tasks
+        results = [None] * total_data
+        pending = iter(enumerate(infer_data))  # 所有worker共享同一迭代器
+        finished = 0
+        progress_interval = max(total_data // 100, 1)
 
-        for batch_idx, batch_start in enumerate(range(0, total_data, self.max_concurrent_tasks), 1):
-            batch_end = min(batch_start + self.max_concurrent_tasks, total_data)
-            batch_data = infer_data[batch_start:batch_end]
-            
-            print(f"处理批次 {batch_idx}/{total_batches} (任务 {batch_start+1}-{batch_end}/{total_data})")
+        loop = asyncio.get_running_loop()
+        # SDK为同步接口，放到线程池中执行，线程数与最大并发一致
+        executor = ThreadPoolExecutor(max_workers=self.limiter.max_concurrency)
+        # 对冲流程阻塞等待，在单独的线程池中执行，每条在途请求占用一个线程
+        race_executor = ThreadPoolExecutor(max_workers=self.limiter.max_concurrency) if self.hedging is not None else None
+        stragglers = {}  # 对冲胜出后仍未结束的原任务（取消后即结束，正常为空）
 
-            # 提交当前批次的任务
-            task_ids = self._submit_async_tasks(batch_data)
+        async def process(idx: int, item: dict, trace: Optional[RequestTrace]):
+            key = keys[idx] if keys is not None else None
+            # 恢复运行时直接轮询日志中已提交的任务
+            task_id = self.journal.task_ids.get(key) if self.journal is not None and key is not None else None
+            submitted_at = time.time()
+            if task_id is None:
+                task_id = await loop.run_in_executor(executor, self._submit_async_task, item)
+                if task_id is not None and self.journal is not None and key is not None:
+                    self.journal.record_submit(key, task_id)
+            if trace is not None and task_id is not None:
+                trace.submitted = time.time()
 
-            # 轮询当前批次的结果
-            batch_results = self._poll_async_tasks(task_ids)
+            if task_id is None:
+                results[idx] = ItemResult.failure("Task failed: 提交任务失败")
+            elif self.hedging is not None:
+                results[idx] = await self._wait_hedged(item, task_id, submitted_at, loop, executor, race_executor,
+                                                     trace, stragglers)
+            else:
+                results[idx] = await self._wait_async_task(task_id, submitted_at, loop, executor, self._max_tokens(item), trace)
+            # 超时的任务保留任务ID，恢复或重试时继续轮询
+            if results[idx].status != STATUS_TIMEOUT:
+                self._record_result(key, results[idx])
+            self._finish_trace(trace, results[idx])
 
-            # 将结果填入总结果列表
-            for i, result in enumerate(batch_results):
-                results[batch_start + i] = result
-                
-            print(f"批次 {batch_idx}/{total_batches} 完成")
+        async def run(idx: int, item: dict):
+            trace = self._start_trace("async", idx, keys, started)
+            await self.limiter.acquire_async()
+            try:
+                await process(idx, item, trace)
+            finally:
+                self.limiter.release()
+
+        async def worker():
+            nonlocal finished
+            for idx, item in pending:
+                await run(idx, item)
+                finished += 1
+                if finished % progress_interval == 0 or finished == total_data:
+                    print(f"已完成 {finished}/{total_data}，{self.limiter.stats()}")
+
+        try:
+            n_workers = min(self.limiter.max_concurrency, total_data)
+            await asyncio.gather(*(worker() for _ in range(n_workers)))
+        finally:
+            if race_executor is not None:
+                race_executor.shutdown(wait=False)
+                self._record_stragglers(stragglers)
+            executor.shutdown(wait=False)
 
         print(f"所有任务完成，共处理 {total_data} 个任务")
         return results
-    
-    def _submit_async_tasks(self, batch_data: List[dict]) -> List[str]:
-        """提交异步任务"""
-        task_ids = []
-        
-        for item in batch_data:
-            system = item.get('system', '')
-            instruction = item.get('instruction', '')
-            input_text = item.get('input', '')
-            
-            # 构建完整的prompt
-            messages = [
-                {"role": "system", "content": system},
-                {"role": "user", "content": f"{instruction}\n\n{input_text}"}
-            ]
-            
+
+    async def _wait_hedged(self, item: dict, task_id: str, submitted_at: float, loop, executor,
+                           race_executor: ThreadPoolExecutor, trace: Optional[RequestTrace], stragglers: Dict) -> ItemResult:
+        """按self.hedging轮询异步任务（见_hedge_race），对冲流程在race_executor中执行，落后的任务取消后停止轮询"""
+        max_tokens = self._max_tokens(item)
+        primary = asyncio.run_coroutine_threadsafe(
+            self._wait_async_task(task_id, submitted_at, loop, executor, max_tokens, trace), loop)
+
+        def launch() -> Optional[Future]:
+            hedge_id = self._submit_async_task(item)
+            if hedge_id is None:
+                return None
+            return asyncio.run_coroutine_threadsafe(
+                self._wait_async_task(hedge_id, time.time(), loop, executor, max_tokens), loop)
+
+        return await loop.run_in_executor(race_executor, self._hedge_race, primary, launch, submitted_at, stragglers)
+
+    def _submit_async_task(self, item: dict) -> Optional[str]:
+        """提交单个异步任务，返回任务ID，失败时返回None；被限流时退避后重试"""
+        max_tokens = self._max_tokens(item)
+        max_tokens_kwargs = {"max_tokens": max_tokens} if max_tokens is not None else {}
+        for attempt in range(self.throttle_max_retries + 1):
+            self.limiter.pace()
+            start = time.time()
             try:
                 response = self.client.chat.asyncCompletions.create(
                     model=self.model,
-                    messages=messages
+                    messages=self._build_messages(item),
+                    **max_tokens_kwargs
                 )
-                task_ids.append(response.id)
+                self.limiter.record(time.time() - start)
+                return response.id
             except Exception as e:
-                print(f"提交任务失败: {str(e)}")
-                task_ids.append(None)
-        
-        return task_ids
-    
-    def _poll_async_tasks(self, task_ids: List[str]) -> List[str]:
-        """轮询异步任务结果"""
-        results = [""] * len(task_ids)
-        
-        for attempt in range(self.async_max_retries):
-            all_done = True
-            
-            for idx, task_id in enumerate(task_ids):
-                if results[idx] or task_id is None:  # 已完成或任务ID为空
+                throttled = is_throttle_error(e)
+                self.limiter.record(error=not throttled and is_server_error(e), throttled=throttled)
+                if not throttled:
+                    print(f"提交任务失败: {str(e)}")
+                    return None
+                time.sleep(self.limiter.throttle_pause * 2 ** attempt)
+        print(f"提交任务失败: 重试{self.throttle_max_retries}次后{THROTTLED_MESSAGE}")
+        return None
+
+    async def _wait_async_task(self, task_id: str, submitted_at: float, loop, executor, max_tokens: Optional[int] = None,
+                               trace: Optional[RequestTrace] = None) -> ItemResult:
+        """按轮询调度器给出的间隔轮询单个异步任务，直到完成、失败或超时；max_tokens用于记录token预算"""
+        overdue_polls = 0
+        last_pending = 0.0  # 最近一次轮询到未完成时的已等待秒数
+        while True:
+            elapsed = time.time() - submitted_at
+            if elapsed >= self.async_timeout:
+                return ItemResult.timeout(latency=elapsed)
+            delay = self.poller.next_delay(elapsed, overdue_polls)
+            # 最后一次轮询不晚于超时时刻
+            await asyncio.sleep(min(delay, self.async_timeout - elapsed))
+
+            await self.limiter.pace_async()
+            start = time.time()
+            try:
+                resp = await loop.run_in_executor(
+                    executor,
+                    functools.partial(self.client.chat.asyncCompletions.retrieve_completion_result, id=task_id)
+                )
+                self.poller.record_poll()
+                self.limiter.record(time.time() - start)
+                if trace is not None:
+                    trace.polls += 1
+            except Exception as e:
+                throttled = is_throttle_error(e)
+                self.limiter.record(error=not throttled and is_server_error(e), throttled=throttled)
+                if throttled:
+                    # 轮询被限流时任务本身不受影响，稍后继续轮询
+                    overdue_polls += 1
                     continue
-                    
+                print(f"轮询任务 {task_id} 时出错: {str(e)}")
+                return ItemResult.failure(f"API Error: {str(e)}", time.time() - submitted_at)
+
+            if resp.task_status == "SUCCESS":
+                # 任务完成于上次未完成与本次完成的轮询之间，取中点作为耗时估计
+                self.poller.record_latency((last_pending + time.time() - submitted_at) / 2)
                 try:
-                    resp = self.client.chat.asyncCompletions.retrieve_completion_result(id=task_id)
-                    
-                    if resp.task_status == "SUCCESS":
-                        results[idx] = resp.choices[0].message.content.strip()
-                    elif resp.task_status == "FAILED":
-                        results[idx] = "Task failed"
-                    else:
-                        all_done = False
-                        
+                    content = resp.choices[0].message.content.strip()
+                    self._record_usage(max_tokens, getattr(resp, 'usage', None), getattr(resp.choices[0], 'finish_reason', None), trace)
                 except Exception as e:
-                    print(f"轮询任务 {task_id} 时出错: {str(e)}")
-                    results[idx] = f"API Error: {str(e)}"
-            
-            if all_done:
-                break
-                
-            time.sleep(1)  # 等待1秒后重试
-        
-        # 处理未完成的任务
-        for idx, result in enumerate(results):
-            if not result and task_ids[idx] is not None:
-                results[idx] = "Task timeout"
-        
-        return results
+                    # 回复缺少choices或content时只有该条失败，不影响其他任务
+                    print(f"解析任务 {task_id} 的结果时出错: {str(e)}")
+                    return ItemResult.failure(f"API Error: {str(e)}", time.time() - submitted_at)
+                return ItemResult.success(content, time.time() - submitted_at)
+            elif resp.task_status in ("FAIL", "FAILED"):
+                # 智谱API以FAIL表示任务失败
+                return ItemResult.failure("Task failed", time.time() - submitted_at)
+            last_pending = time.time() - submitted_at
+            overdue_polls += 1
 
-    def http_call(self, messages: List[Dict], temperature: float = 0.6, max_tokens: int = 1024) -> str:
-        """HTTP方式调用智谱AI API"""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+    def _get_session(self) -> "requests.Session":
+        """获取共享的keep-alive连接池，所有HTTP调用复用同一个Session"""
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=max(self.http_max_workers, 1)
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                })
+                self._session = session
+            return self._session
 
+    def http_call(self, messages: List[Dict], temperature: float = 0.6, max_tokens: int = 1024,
+                  trace: Optional[RequestTrace] = None, stream: bool = False,
+                  stop: Optional[Callable[[str], bool]] = None) -> str:
+        """HTTP方式调用智谱AI API，返回回复内容，失败时返回错误信息"""
         data = {
             "model": self.model,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens
         }
+        if stream:
+            data["stream"] = True
+        return self._http_call(json_dumps_bytes(data), max_tokens, trace, stream, stop).text
 
+    def _http_call(self, body: bytes, max_tokens: int = 1024, trace: Optional[RequestTrace] = None,
+                   stream: bool = False, stop: Optional[Callable[[str], bool]] = None) -> ItemResult:
+        """
+        发出一次HTTP调用，body为已编码的请求体，传入trace时记录发出时刻、首个token时刻和token用量
+
+        stream为True时以流式（SSE）接收回复，stop(已接收文本)返回True时立即断开连接，以已接收的文本作为结果。
+        """
+
+        # 占用一个并发名额
+        self.limiter.acquire()
         try:
-            response = requests.post(self.base_url, headers=headers, json=data)
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content'].strip()
-            else:
-                raise Exception(f"API调用失败: {response.status_code}, {response.text}")
-        except Exception as e:
-            print(f"HTTP调用出错: {str(e)}")
-            return f"HTTP Error: {str(e)}"
+            return self._http_attempts(body, max_tokens, trace, stream, stop)
+        finally:
+            self.limiter.release()
+
+    def _http_attempts(self, body: bytes, max_tokens: int = 1024, trace: Optional[RequestTrace] = None,
+                       stream: bool = False, stop: Optional[Callable[[str], bool]] = None) -> ItemResult:
+        """在调用方已占用的并发名额内发出HTTP调用，被限流时按指数退避重试"""
+        for attempt in range(self.throttle_max_retries + 1):
+            self.limiter.pace()
+            start = time.time()
+            if trace is not None:
+                trace.submitted = start
+            try:
+                response = self._get_session().post(self.base_url, data=body, stream=stream)
+                
+                if response.status_code != 200:
+                    raise HTTPCallError(response.status_code, response.text)
+                if stream:
+                    with response:
+                        content, usage, finish_reason, first_token = self._read_stream(response, stop)
+                    if trace is not None:
+                        trace.first_token = first_token
+                    # 流式调用以首token耗时作为拥塞信号，不受输出长度和提前停止的影响
+                    self.limiter.record((first_token or time.time()) - start)
+                else:
+                    result = response.json()
+                    content = result['choices'][0]['message']['content']
+                    usage, finish_reason = result.get('usage'), result['choices'][0].get('finish_reason')
+                    self.limiter.record(time.time() - start)
+                self._record_usage(max_tokens, usage, finish_reason, trace)
+                return ItemResult.success(content.strip(), time.time() - start)
+            except Exception as e:
+                throttled = is_throttle_error(e)
+                self.limiter.record(error=not throttled and is_server_error(e), throttled=throttled)
+                if not throttled:
+                    print(f"HTTP调用出错: {str(e)}")
+                    return ItemResult.failure(f"HTTP Error: {str(e)}", time.time() - start)
+                if attempt == self.throttle_max_retries:
+                    message = f"重试{self.throttle_max_retries}次后{THROTTLED_MESSAGE}: {str(e)}"
+                    print(f"HTTP调用出错: {message}")
+                    return ItemResult.failure(f"HTTP Error: {message}", time.time() - start)
+            time.sleep(self.limiter.throttle_pause * 2 ** attempt)
 
-    def http_process(self, infer_data: List[dict], temperature: float = 0.6) -> List[str]:
-        """使用HTTP方式批量处理数据"""
-        results = []
+    def _read_stream(self, response: "requests.Response", stop: Optional[Callable[[str], bool]] = None
+                     ) -> Tuple[str, Optional[dict], Optional[str], Optional[float]]:
+        """读取流式回复，返回 (文本, usage, finish_reason, 首个token时刻)；stop触发时finish_reason为early_stop"""
+        content = ""
+        usage = finish_reason = first_token = None
+        for event in iter_sse_events(response.iter_lines()):
+            if event.get('usage'):
+                usage = event['usage']
+            choices = event.get('choices') or [{}]
+            delta = (choices[0].get('delta') or {}).get('content')
+            if choices[0].get('finish_reason'):
+                finish_reason = choices[0]['finish_reason']
+            if not delta:
+                continue
+            if first_token is None:
+                first_token = time.time()
+            content += delta
+            if stop is not None and stop(content):
+                finish_reason = "early_stop"
+                break
+        return content, usage, finish_reason, first_token
+
+    def http_process(self, infer_data: List[dict], temperature: float = 0.6, max_workers: int = None,
+                     stream: bool = False, stop: Optional[Callable[[dict, str], bool]] = None) -> List[ItemResult]:
+        """
+        使用HTTP方式批量处理数据
+
+        max_workers为并发线程数，默认使用self.http_max_workers；为1时逐条顺序请求。
+        所有线程共享同一个连接池，实际并发和请求速率由self.limiter自适应控制，结果按输入顺序返回。
+        stream为True时流式接收回复；stop(输入数据, 已接收文本)返回True时提前结束该条请求，
+        如streaming.stop_on_rhetoric_label在修辞识别的标签确定后即停止。
+        提前停止的结果与完整回复不同，停止条件参与请求键计算（见_stop_key）：lambda等没有稳定标识的停止条件
+        不使用缓存和运行日志，需要缓存时传入模块级函数或设置了cache_key属性的可调用对象。
+        """
+        params = {"temperature": temperature, "max_tokens": 1024}
+        if stream:
+            params["stream"] = True
+        dispatch = lambda data, keys: self._http_process(data, keys, temperature, max_workers, stream, stop)
+        if stop is not None:
+            params["early_stop"] = _stop_key(stop)
+            if params["early_stop"] is None:
+                if self.cache is not None or self.journal is not None:
+                    print(f"提前停止条件 {stop!r} 没有稳定的标识（可设置cache_key属性），本次不使用缓存和运行日志")
+                return self._ordered_dispatch(infer_data, None, dispatch)
+        return self._dispatch(infer_data, dispatch, **params)
+
+    def _http_process(self, infer_data: List[dict], keys: Optional[List[str]] = None,
+                      temperature: float = 0.6, max_workers: int = None, stream: bool = False,
+                      stop: Optional[Callable[[dict, str], bool]] = None) -> List[ItemResult]:
+        """按max_workers并发执行HTTP请求"""
+        started = time.time()
+        max_workers = max_workers or self.http_max_workers
         total_data = len(infer_data)
-        
-        for i, item in enumerate(infer_data):
-            print(f"处理任务 {i+1}/{total_data}")
-            
-            system = item.get('system', '')
-            instruction = item.get('instruction', '')
-            input_text = item.get('input', '')
-            
-            # 构建完整的prompt
-            messages = [
-                {"role": "system", "content": system},
-                {"role": "user", "content": f"{instruction}\n\n{input_text}"}
-            ]
-            
-            result = self.http_call(messages, temperature)
-            results.append(result)
-            
-            # 避免请求过于频繁
-            time.sleep(0.1)
-        
+        results = [None] * total_data
+
+        def run(i: int) -> ItemResult:
+            item = infer_data[i]
+            trace = self._start_trace("http", i, keys, started)
+            item_stop = (lambda text: stop(item, text)) if stop is not None else None
+            max_tokens = self._max_tokens(item, 1024)
+            body = self._template(item).encode_body(item.get('input', ''), temperature=temperature, max_tokens=max_tokens,
+                                                    stream=True if stream else None)
+            if self.hedging is not None:
+                result = self._hedged_http_call(body, max_tokens, trace, stream, item_stop, call_executor, stragglers)
+            else:
+                result = self._http_call(body, max_tokens, trace, stream, item_stop)
+            self._record_result(keys[i] if keys is not None else None, result)
+            self._finish_trace(trace, result)
+            return result
+
+        # 对冲时每条请求的原请求和对冲请求在单独的线程池中发出，结束时不等待落后的请求
+        call_executor = ThreadPoolExecutor(max_workers=2 * max_workers) if self.hedging is not None else None
+        stragglers = {}  # 对冲胜出后仍在执行的原请求
+        try:
+            if max_workers <= 1:
+                for i in range(total_data):
+                    print(f"处理任务 {i+1}/{total_data}")
+                    results[i] = run(i)
+            else:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {executor.submit(run, i): i for i in range(total_data)}
+                    for finished, future in enumerate(as_completed(futures), 1):
+                        results[futures[future]] = future.result()
+                        if finished % max_workers == 0 or finished == total_data:
+                            print(f"已完成 {finished}/{total_data}，{self.limiter.stats()}")
+        finally:
+            if call_executor is not None:
+                call_executor.shutdown(wait=False)
+                self._record_stragglers(stragglers)
+
         print(f"HTTP批量处理完成，共处理 {total_data} 个任务")
         return results
 
+    def _hedged_http_call(self, body: bytes, max_tokens: int, trace: Optional[RequestTrace], stream: bool,
+                          stop: Optional[Callable[[str], bool]], executor: ThreadPoolExecutor,
+                          stragglers: Dict) -> ItemResult:
+        """
+        按self.hedging发出HTTP调用（见_hedge_race），原请求和对冲请求在executor中执行
+
+        已发出的HTTP请求无法中途取消，落后的请求执行到结束后才归还并发名额，不阻塞本条请求返回。
+        """
+        self.limiter.acquire()
+        started = time.time()
+        primary = executor.submit(self._http_attempts, body, max_tokens, trace, stream, stop)
+        primary.add_done_callback(lambda _: self.limiter.release())
+        return self._hedge_race(
+            primary, lambda: executor.submit(self._http_attempts, body, max_tokens, None, stream, stop), started, stragglers)
+
+    def _hedge_race(self, primary: Future, launch: Callable[[], Optional[Future]], started: float,
+                    stragglers: Dict) -> ItemResult:
+        """
+        异步和HTTP模式共用的请求对冲流程，在调用方线程中阻塞执行
+
+        primary为started时刻发出的原请求（其并发名额由调用方占用和归还）。超过对冲阈值仍未完成且有空闲并发名额时
+        调用launch()再发出一份相同的请求（返回Future，发出失败时返回None），对冲请求另占一个并发名额直到结束。
+        先成功的结果生效，另一份请求取消；无法取消的原请求记入stragglers（请求 -> 发出时刻），完成时再统计其耗时。
+        """
+        policy = self.hedging
+        policy.start(started)
+        primary_finished = []
+        primary.add_done_callback(lambda _: primary_finished.append(time.time()))
+        futures = [primary]
+        delay = policy.delay()
+        if delay is not None:
+            wait(futures, timeout=max(delay - (time.time() - started), 0))
+            while not primary.done():
+                # 并发名额用满或超出预算时稍后再试，避免在拥塞时加重负载
+                if self.limiter.try_acquire():
+                    if policy.try_hedge():
+                        hedge = launch()
+                        if hedge is None:
+                            self.limiter.release()
+                        else:
+                            hedge.add_done_callback(lambda _: self.limiter.release())
+                            futures.append(hedge)
+                        break
+                    self.limiter.release()
+                wait(futures, timeout=policy.retry_interval)
+
+        for future in as_completed(futures):
+            result = future.result()
+            if result.ok:
+                break
+        latency = time.time() - started
+        hedge_won = result.ok and future is not primary
+        policy.record(started, latency, hedge_won)
+        for loser in futures:
+            if loser is not future:
+                loser.cancel()
+        if primary_finished:
+            # 原请求已完成或已取消，取消的以已等待的时间计
+            policy.record_unhedged(primary_finished[0] - started)
+        else:
+            def straggler_done(_):
+                if stragglers.pop(primary, None) is not None:
+                    policy.record_unhedged(time.time() - started)
+
+            stragglers[primary] = started
+            primary.add_done_callback(straggler_done)
+        if hedge_won:
+            return ItemResult.success(result.content, latency)
+        return result
+
+    def _record_stragglers(self, stragglers: Dict):
+        """引擎结束时仍未完成的原请求以已等待的时间计入未对冲耗时"""
+        now = time.time()
+        for future, sent_at in list(stragglers.items()):
+            if stragglers.pop(future, None) is not None:
+                self.hedging.record_unhedged(now - sent_at)
+
+    def packed_process(self, infer_data: List[dict], process: Callable[[List[dict]], List[ItemResult]] = None,
+                       pack_size: int = 8) -> List[ItemResult]:
+        """
+        将pack_size条短输入打包进一个请求，要求模型按编号逐条作答，再把回复拆回各条输入
+
+        适用于修辞识别等输入和输出都很短的分类任务，请求数和重复的system/instruction前缀约减少为1/pack_size。
+        process为实际执行推理的方法（默认self.async_process）。
+        回复无法对齐的条目（缺失、重复编号或请求失败）会单独以不打包的方式重新请求。
+        """
+        process = process or self.async_process
+        packs, members = pack_items(infer_data, pack_size)
+        print(f"打包推理：{len(infer_data)} 条输入打包为 {len(packs)} 个请求")
+        replies = process(packs)
+
+        results = [None] * len(infer_data)
+        unaligned = []
+        for pack_members, reply in zip(members, replies):
+            answers = parse_packed_reply(reply.content, len(pack_members)) if reply.ok else {}
+            for number, idx in enumerate(pack_members, 1):
+                if number in answers:
+                    results[idx] = ItemResult.success(answers[number], reply.latency, reply.attempts)
+                else:
+                    unaligned.append(idx)
+
+        if unaligned:
+            print(f"{len(unaligned)} 条输入未能从打包回复中对齐，单独重新请求")
+            retry_results = process([infer_data[i] for i in unaligned])
+            for idx, result in zip(unaligned, retry_results):
+                results[idx] = result
+        return results
+
+    def process_with_retry(self, infer_data: List[dict], process: Callable[[List[dict]], List[ItemResult]] = None,
+                           max_attempts: int = 3, retry_backoff: float = 10.0) -> List[ItemResult]:
+        """
+        执行推理后只把失败或超时的条目重新提交，最多共max_attempts轮，第n轮重试前等待 retry_backoff * 2**(n-1) 秒
+
+        process为实际执行推理的方法（默认self.async_process）。
+        启用运行日志时，超时的异步任务在重试中继续轮询原任务而不重复提交。
+        """
+        process = process or self.async_process
+        results = process(infer_data)
+        for attempt in range(1, max_attempts):
+            failed = [i for i, result in enumerate(results) if not result.ok]
+            if not failed:
+                break
+            delay = retry_backoff * 2 ** (attempt - 1)
+            print(f"{len(failed)}/{len(infer_data)} 条请求失败或超时，{delay:.0f}秒后第{attempt}次重试")
+            time.sleep(delay)
+            retried = process([infer_data[i] for i in failed])
+            for i, result in zip(failed, retried):
+                result.attempts += results[i].attempts
+                results[i] = result
+        n_failed = sum(not result.ok for result in results)
+        if n_failed:
+            print(f"重试后仍有 {n_failed} 条请求失败")
+        return results
+
+    def close(self):
+        """关闭HTTP连接池"""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
 
 if __name__ == "__main__":
     pass
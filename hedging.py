@@ -0,0 +1,93 @@
+import threading
+from typing import Optional
+
+from polling import LatencyWindow
+
+
+class HedgePolicy:
+    """
+    请求对冲（hedged requests）策略，异步和HTTP模式共用
+
+    以本次运行中已完成请求的耗时为样本，单条请求耗时超过分位数quantile后再发出一份相同的请求，
+    先成功返回的结果生效，另一份被取消。额外发出的请求数不超过已发出请求数的budget比例，
+    并发名额用满或超出预算时每隔retry_interval秒重新尝试，直到原请求完成。
+
+    对冲效果按条统计：有效耗时为实际拿到结果的耗时，未对冲耗时为原请求自身完成的耗时。
+    对冲胜出后落后的原请求被取消（HTTP请求无法中途取消，执行到结束为止，引擎结束时仍未完成的以已等待的时间计），
+    被取消的原请求以取消时已等待的时间计，因此未对冲耗时是下限，对p99降幅的估计偏保守。
+    总耗时为最早发出到最晚拿到结果的时间；未对冲的总耗时无法从同一次运行得到，
+    stats传入相同数据不启用对冲时的总耗时后给出总耗时降幅（见benchmark.py的对比运行）。
+    """
+
+    def __init__(self, quantile: float = 0.95, budget: float = 0.05, min_samples: int = 20,
+                 retry_interval: float = 0.1):
+        """
+        Args:
+            quantile: 触发对冲的耗时分位数（0~1）
+            budget: 对冲请求数占请求总数的上限比例
+            min_samples: 完成样本数达到该值后才开始对冲
+            retry_interval: 暂时无法对冲时重新尝试的间隔秒数
+        """
+        self.quantile = quantile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.retry_interval = retry_interval
+        self.latencies = LatencyWindow()  # 未对冲耗时的滑动窗口，用于计算对冲阈值
+        self.effective = LatencyWindow(size=100000)
+        self.unhedged = LatencyWindow(size=100000)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._first_start = None  # 最早的请求发出时刻
+        self._finished = 0.0  # 最晚拿到结果的时刻
+        self._lock = threading.Lock()
+
+    def start(self, started: float):
+        """每条请求首次发出时调用，started为发出时刻"""
+        with self._lock:
+            self.requests += 1
+            if self._first_start is None or started < self._first_start:
+                self._first_start = started
+
+    def delay(self) -> Optional[float]:
+        """请求发出后多少秒仍未完成时对冲，样本不足时返回None（不对冲）"""
+        if len(self.latencies) < self.min_samples:
+            return None
+        return self.latencies.quantile(self.quantile)
+
+    def try_hedge(self) -> bool:
+        """在预算内占用一次对冲名额"""
+        with self._lock:
+            if self.hedged + 1 > self.budget * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def record(self, started: float, latency: float, hedge_won: bool = False):
+        """记录一条请求实际拿到结果的耗时，hedge_won表示是否由对冲请求先返回"""
+        self.effective.add(latency)
+        with self._lock:
+            self.hedge_wins += hedge_won
+            self._finished = max(self._finished, started + latency)
+
+    def record_unhedged(self, latency: float):
+        """记录原请求自身完成（或被取消）时的耗时，同时作为对冲阈值的样本"""
+        self.latencies.add(latency)
+        self.unhedged.add(latency)
+
+    def stats(self, baseline_run_time: Optional[float] = None) -> dict:
+        """对冲统计；baseline_run_time为相同数据不启用对冲时的总耗时，传入时给出总耗时降幅run_time_saved"""
+        p99, unhedged_p99 = self.effective.quantile(0.99), self.unhedged.quantile(0.99)
+        run_time = max(self._finished - self._first_start, 0.0) if self._first_start is not None else None
+        stats = {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": round(self.hedged / self.requests, 4) if self.requests else 0.0,
+            "p99": round(p99, 3) if p99 is not None else None,
+            "unhedged_p99": round(unhedged_p99, 3) if unhedged_p99 is not None else None,
+            "run_time": round(run_time, 3) if run_time is not None else None,
+        }
+        if baseline_run_time and run_time is not None:
+            stats["run_time_saved"] = round(1 - run_time / baseline_run_time, 4)
+        return stats
@@ -23,6 +23,11 @@ SEGMENTATION_INSTRUCTION = """你的任务是对输入的中文句子或文本
 
 """
 
-
-
-
+# 多条输入打包为一个请求时追加在instruction之后的说明，{count}为本次打包的条数
+PACKED_INSTRUCTION = """
+下面共有{count}条输入，每条以【编号】开头。请对每条输入分别按上述要求作答。
+每条答案单独占一行，并以对应的【编号】开头，例如：
+【1】答案
+【2】答案
+不要遗漏或合并任何一条，也不要输出其他内容。
+"""
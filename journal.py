@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+from typing import Dict, List
+
+
+class RunJournal:
+    """
+    推理任务的追加式日志（journal.jsonl）
+
+    每行一个事件，记录运行参数、已提交的异步任务ID/Batch ID以及已完成的结果。
+    所有条目以请求缓存键（CompiledTemplate.request_key）标识，重新打开同一工作目录时回放日志恢复状态：
+    - results: 已成功完成的 {key: content}
+    - task_ids: 已提交但尚无结果的异步任务 {key: task_id}
+    - batches: 已创建但尚未取回结果的Batch {batch_id: [key, ...]}
+    """
+
+    FILE_NAME = "journal.jsonl"
+
+    def __init__(self, work_dir: str, fsync: bool = False):
+        """
+        Args:
+            work_dir: 工作目录，日志保存在其中的journal.jsonl
+            fsync: 每次写入后是否调用os.fsync，开启后可抵御断电但写入更慢
+        """
+        os.makedirs(work_dir, exist_ok=True)
+        self.path = os.path.join(work_dir, self.FILE_NAME)
+        self.fsync = fsync
+        self.meta = {}
+        self.results: Dict[str, str] = {}
+        self.task_ids: Dict[str, str] = {}
+        self.batches: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            self._replay()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _replay(self):
+        """回放已有日志，忽略进程崩溃时可能写了一半的末行"""
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._apply(event)
+
+    def _apply(self, event: dict):
+        kind = event.get("event")
+        if kind == "meta":
+            self.meta.update(event.get("meta", {}))
+        elif kind == "submit":
+            self.task_ids[event["key"]] = event["task_id"]
+        elif kind == "batch":
+            self.batches[event["batch_id"]] = event["keys"]
+        elif kind == "batch_done":
+            self.batches.pop(event["batch_id"], None)
+        elif kind == "result":
+            # 失败的任务不再保留任务ID，恢复时重新提交
+            self.task_ids.pop(event["key"], None)
+            if not event.get("failed"):
+                self.results[event["key"]] = event["content"]
+
+    def _write(self, event: dict):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._apply(event)
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def record_meta(self, **meta):
+        """记录运行参数（模型、推理模式、测试集路径等），resume时据此重建任务"""
+        self._write({"event": "meta", "meta": meta})
+
+    def record_submit(self, key: str, task_id: str):
+        """记录已提交的异步任务"""
+        self._write({"event": "submit", "key": key, "task_id": task_id})
+
+    def record_batch(self, batch_id: str, keys: List[str]):
+        """记录已创建的Batch及其包含的请求（按custom_id顺序）"""
+        self._write({"event": "batch", "batch_id": batch_id, "keys": keys})
+
+    def record_batch_done(self, batch_id: str):
+        """记录Batch结果已取回"""
+        self._write({"event": "batch_done", "batch_id": batch_id})
+
+    def record_result(self, key: str, content: str, failed: bool = False):
+        """记录一条请求的最终结果"""
+        self._write({"event": "result", "key": key, "content": content, "failed": failed})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -1,8 +1,23 @@
 from datetime import datetime
+import argparse
 import os
-from utils import load_json_file, load_jsonl_file, save_json_file
-from glm_api import GLMAPI
-from data_process import genrate_segment_dataset, generate_rhetoric_dataset
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable
+from utils import json_dumps, load_jsonl_file, save_json_file
+from cache import ResponseCache
+from hedging import HedgePolicy
+from journal import RunJournal
+from metrics import MetricsRecorder
+from planner import DispatchPlan, DispatchPlanner
+from results import STATUS_SUCCESS, ItemResult
+from results_store import ResultsStore
+from scheduling import TokenBudget
+from data_process import DatasetRecord, genrate_segment_dataset, generate_rhetoric_dataset, iter_dataset, load_dataset
+
+# glm_api（智谱SDK、requests）和sharding只在实际发起推理时导入，数据生成和评估命令无需加载
+if TYPE_CHECKING:
+    from glm_api import GLMAPI
 
 
 def process_inference_results(work_dir, test_data_path, predictions_source: list|str):
@@ -13,8 +28,10 @@ def process_inference_results(work_dir, test_data_path, predictions_source: list
         work_dir: 工作目录
         test_data_path: 测试数据路径
         predictions_source: 预测结果源（jsonl文件路径或直接的预测结果列表）
+
+    预测结果为ItemResult时，失败或超时的条目llm_pred为空，并记录llm_status和llm_error。
     """
-    all_test_data = load_json_file(test_data_path)
+    all_test_data = load_dataset(test_data_path)
     
     if isinstance(predictions_source, str):
         assert predictions_source.endswith('.jsonl'), "predictions_source must be a jsonl file path"
@@ -40,47 +57,313 @@ def process_inference_results(work_dir, test_data_path, predictions_source: list
     # 验证长度匹配
     assert len(predictions) == len(all_test_data), f"Length mismatch: {len(predictions)} vs {len(all_test_data)}"
     
-    for pred, record in zip(predictions, all_test_data):
-        record["raw_data"]["llm_pred"] = pred.strip() if isinstance(pred, str) else str(pred).strip()
-
+    all_test_data = [join_prediction(record, pred) for pred, record in zip(predictions, all_test_data)]
     results_file = os.path.join(work_dir, "results.json")
     save_json_file(data=all_test_data, path=results_file)
     
     return results_file
 
 
-def api_infer(model="glm-4-plus", test_data_path=None, task_description="修辞检测"):
-    """使用GLM API进行批处理推理"""
+def join_prediction(record, pred) -> dict:
+    """把一条预测结果写入测试记录的raw_data，返回完整的dict格式记录"""
+    if isinstance(pred, ItemResult):
+        record["raw_data"]["llm_pred"] = pred.content.strip() if pred.ok else ""
+        record["raw_data"]["llm_status"] = pred.status
+        record["raw_data"]["llm_attempts"] = pred.attempts
+        if not pred.ok:
+            record["raw_data"]["llm_error"] = pred.error
+    else:
+        record["raw_data"]["llm_pred"] = pred.strip() if isinstance(pred, str) else str(pred).strip()
+    return record.to_dict() if isinstance(record, DatasetRecord) else record
+
+
+API_KEY = "your_api_key_here"
+# 分片推理（sharded=True）使用的key池，每个元素为key字符串或 {"api_key", "api_base", "model"} 字典
+API_KEYS = [API_KEY]
+
+
+def run_inference(api_client: "GLMAPI", test_data: list, mode: str = "async", task_description: str = "", pack_size: int = 1,
+                  max_attempts: int = 3) -> list:
+    """按推理模式调用GLM API，pack_size大于1时每个请求打包多条输入，失败或超时的条目最多共尝试max_attempts轮"""
+    if mode == "batch":
+        print("API批处理推理")
+        process = lambda data: api_client.batch_process(infer_data=data, description=task_description)
+    elif mode == "async":
+        print("API异步推理")
+        process = lambda data: api_client.async_process(infer_data=data)
+    elif mode == "http":
+        print("API HTTP推理")
+        process = lambda data: api_client.http_process(infer_data=data)
+    else:
+        raise ValueError(f"Unsupported mode: {mode}")
+
+    if pack_size > 1:
+        packed = process
+        process = lambda data: api_client.packed_process(data, packed, pack_size)
+    return api_client.process_with_retry(test_data, process, max_attempts)
+
+
+def run_pipelined_inference(api_client: "GLMAPI", records: Iterable, results_path: str, mode: str = "async",
+                            task_description: str = "", pack_size: int = 1, max_attempts: int = 3,
+                            chunk_size: int = None, window: int = 8) -> int:
+    """
+    流水线推理：逐块读取测试数据、提交推理，每块完成后立即把结果并入raw_data追加写入results_path（JSONL）
+
+    最多window块同时推理（共享api_client的限流器），读取、提交、轮询和写出相互重叠，
+    内存中只保留在途的数据。每行带有输入下标index，按完成顺序写入ResultsStore（同时维护偏移索引results_path.idx），
+    可在运行中或运行后按下标随机读取。恢复运行时跳过最新一条记录为成功（llm_status为success）的下标，
+    失败或超时的条目重新推理并追加写入（索引指向最新一行），启用运行日志时超时的异步任务继续轮询原任务。
+    chunk_size默认batch模式为5000条，其他模式为32条。返回本次写出的条数。
+    """
+    chunk_size = chunk_size or (5000 if mode == "batch" else 32)
+    written = 0
+    with ResultsStore(results_path) as store, ThreadPoolExecutor(max_workers=window) as executor:
+        done = {
+            record["index"] for record in store
+            if (record.get("raw_data") or {}).get("llm_status", STATUS_SUCCESS) == STATUS_SUCCESS
+        }
+        stored = store.count()
+        if stored:
+            print(f"{results_path} 中已有 {stored} 条结果，跳过其中成功的 {len(done)} 条，"
+                  f"失败或超时的 {stored - len(done)} 条重新推理")
+        todo = ((i, record) for i, record in enumerate(records) if i not in done)
+        running = {}
+
+        def write_finished(futures):
+            nonlocal written
+            for future in futures:
+                chunk = running.pop(future)
+                for (i, record), pred in zip(chunk, future.result()):
+                    store.append(i, join_prediction(record, pred))
+                written += len(chunk)
+            print(f"流水线推理：已写出 {written} 条结果")
+
+        while True:
+            chunk = list(islice(todo, chunk_size))
+            if not chunk:
+                break
+            future = executor.submit(run_inference, api_client, [record for _, record in chunk], mode, task_description,
+                                     pack_size, max_attempts)
+            running[future] = chunk
+            if len(running) >= window:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                write_finished(finished)
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            write_finished(finished)
+    return written
+
+
+def run_planned_inference(api_client: "GLMAPI", test_data: list, plan: DispatchPlan, task_description: str = "", pack_size: int = 1,
+                          max_attempts: int = 3) -> list:
+    """按分派方案同时以多种模式推理各部分数据，结果按输入顺序合并"""
+    if not plan.parts:
+        # 没有数据时方案不含任何部分
+        return []
+    with ThreadPoolExecutor(max_workers=len(plan.parts)) as executor:
+        futures = [
+            executor.submit(run_inference, api_client, test_data[start:stop], mode, task_description, pack_size, max_attempts)
+            for mode, start, stop in plan.parts
+        ]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+    return results
+
+
+def api_infer(model="glm-4-plus", test_data_path=None, task_description="修辞检测", mode="async", cache_path="saves/response_cache.sqlite", token_budget=False, pack_size=1, metrics=True,
+              deadline=None, urgent=0, max_attempts=3, sharded=False, pipelined=False, hedge=None, hedge_budget=0.05):
+    """
+    使用GLM API进行推理
+
+    mode可选batch/async/http/auto；cache_path为None时不使用响应缓存；
+    auto模式按数据量、模型是否支持Batch、截止时间deadline（秒）和实测吞吐选择模式或在多种模式间拆分，
+    前urgent条数据视为延迟敏感，始终走在线模式；失败或超时的条目只重新提交这一部分，最多共尝试max_attempts轮；
+    token_budget为True时按任务类型和输入长度为每条请求设置max_tokens，并按估算输出长度从长到短发出请求；
+    pack_size大于1时把多条短输入打包进一个请求（适用于修辞识别等分类任务）；
+    metrics为True时在工作目录下写出逐条请求记录trace.jsonl和汇总指标metrics.json/metrics.prom。
+    sharded为True时（不适用于auto模式）把数据分给API_KEYS中每个key的工作进程推理，
+    限流或慢的key自动少分数据，token_budget和hedge在各工作进程中分别生效，请求指标汇总到主进程；
+    分片推理不写运行日志，中断后重跑时已完成的请求从响应缓存取回。
+    pipelined为True时（不适用于auto模式和分片推理）逐块推理，每块完成后立即追加写入工作目录下的results.jsonl，
+    运行中即可读取部分结果，不再在结束时整体写出results.json。
+    hedge为0~1之间的分位数时在async/http模式中启用请求对冲：耗时超过本次运行该分位数的请求再发一份，先返回者生效，
+    对冲请求数不超过请求总数的hedge_budget比例。
+    运行过程写入工作目录下的journal.jsonl，进程中断后可用resume(work_dir)继续。
+    """
     
     assert test_data_path, "test_data_path must be provided for API inference"
+    assert not pipelined or (mode != "auto" and not sharded), "pipelined不适用于auto模式和分片推理"
     
     timestamp = datetime.now().strftime("%m%d_%H%M")
     work_dir = f"saves/api_infer_{timestamp}"
     os.makedirs(work_dir, exist_ok=True)
-    
-    # 初始化API客户端
-    api_key = "your_api_key_here" 
-    api_client = GLMAPI(api_key=api_key, model=model)
 
-    test_data = load_json_file(test_data_path)
-    
-    # 进行批处理推理
-    # print("开始API批处理推理...")
-    # results = api_client.batch_process(
-    #     infer_data=load_json_file(test_data_path),
-    #     description=task_description
-    # )
-    print("API异步推理")
-    results:list = api_client.async_process(
-        infer_data=test_data,
+    journal = RunJournal(work_dir)
+    journal.record_meta(
+        model=model,
+        test_data_path=test_data_path,
+        task_description=task_description,
+        mode=mode,
+        cache_path=cache_path,
+        token_budget=token_budget,
+        pack_size=pack_size,
+        metrics=metrics,
+        deadline=deadline,
+        urgent=urgent,
+        max_attempts=max_attempts,
+        sharded=sharded,
+        pipelined=pipelined,
+        hedge=hedge,
+        hedge_budget=hedge_budget
     )
-    process_inference_results(work_dir, test_data_path, results)
+    return _run_with_journal(work_dir, journal)
+
+
+def resume(work_dir):
+    """从工作目录中的journal.jsonl恢复中断的推理：重新轮询已提交的任务，只提交从未发送过的数据"""
+    journal = RunJournal(work_dir)
+    assert journal.meta, f"{work_dir} 中没有可恢复的运行日志"
+    print(f"恢复推理: 已完成 {len(journal.results)} 条，待轮询任务 {len(journal.task_ids)} 个，待轮询Batch {len(journal.batches)} 个")
+    return _run_with_journal(work_dir, journal)
+
+
+def _run_with_journal(work_dir, journal: RunJournal):
+    from glm_api import GLMAPI
+
+    meta = journal.meta
+    cache_path = meta.get("cache_path")
+    cache = ResponseCache(cache_path) if cache_path else None
+    token_budget = TokenBudget() if meta.get("token_budget") else None
+    metrics = MetricsRecorder(os.path.join(work_dir, "trace.jsonl")) if meta.get("metrics") else None
+    hedging = HedgePolicy(meta["hedge"], meta.get("hedge_budget", 0.05)) if meta.get("hedge") else None
+    api_client = GLMAPI(api_key=API_KEY, model=meta["model"], cache=cache, journal=journal, token_budget=token_budget,
+                        metrics=metrics, hedging=hedging)
+
+    planner = DispatchPlanner()
+    try:
+        if meta.get("pipelined"):
+            # 逐条读取测试数据，结果随完成随写出
+            run_pipelined_inference(api_client, iter_dataset(meta["test_data_path"]), os.path.join(work_dir, "results.jsonl"),
+                                    meta["mode"], meta["task_description"], meta.get("pack_size", 1),
+                                    meta.get("max_attempts", 3))
+        else:
+            test_data = load_dataset(meta["test_data_path"])
+            if meta["mode"] == "auto":
+                # 恢复运行时沿用首次的方案，保证已提交的任务仍由原模式取回
+                if "plan" in meta:
+                    plan = DispatchPlan.from_dict(meta["plan"])
+                else:
+                    plan = planner.plan(len(test_data), meta["model"], meta.get("deadline"), meta.get("urgent", 0))
+                    journal.record_meta(plan=plan.to_dict())
+                print(f"自动分派方案: {plan.describe()}")
+                results = run_planned_inference(api_client, test_data, plan, meta["task_description"],
+                                                meta.get("pack_size", 1), meta.get("max_attempts", 3))
+            elif meta.get("sharded"):
+                from sharding import ShardedRunner
+                runner = ShardedRunner(API_KEYS, model=meta["model"], mode=meta["mode"],
+                                       task_description=meta["task_description"], pack_size=meta.get("pack_size", 1),
+                                       cache_path=cache_path, max_attempts=meta.get("max_attempts", 3),
+                                       token_budget=token_budget is not None, hedge=meta.get("hedge"),
+                                       hedge_budget=meta.get("hedge_budget", 0.05), metrics=metrics)
+                results = runner.run(test_data)
+            else:
+                results = run_inference(api_client, test_data, meta["mode"], meta["task_description"],
+                                        meta.get("pack_size", 1), meta.get("max_attempts", 3))
+            process_inference_results(work_dir, meta["test_data_path"], results)
+        if meta.get("sharded"):
+            # 分片推理的token预算和对冲统计在各进程中分别记录
+            print(f"各分片统计: {runner.stats()}")
+        elif token_budget is not None:
+            print(f"token预算统计: {token_budget.report()}")
+        if hedging is not None and not meta.get("sharded"):
+            print(f"请求对冲统计: {hedging.stats()}")
+    finally:
+        journal.close()
+        if metrics is not None:
+            metrics.save(os.path.join(work_dir, "metrics.json"), os.path.join(work_dir, "metrics.prom"))
+            print(f"请求指标: {metrics.snapshot()}")
+            # 用实测吞吐更新各模式的性能估计，供之后的auto模式使用
+            planner.update_from_metrics(metrics.snapshot())
+            metrics.close()
+        if cache is not None:
+            print(f"缓存统计: {cache.stats()}")
+            cache.close()
     return work_dir
 
 
-if __name__ == "__main__":
-    
-    _, test_data_path = genrate_segment_dataset()
-    # 示例：使用GLM API进行批处理推理
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="GLM API推理工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate = subparsers.add_parser("generate", help="由原始数据生成推理用数据集")
+    generate.add_argument("task", choices=["segment", "rhetoric"])
+    generate.add_argument("--dataset-path", help="原始数据目录，默认segment_data或rhetoric_data")
+    generate.add_argument("--output-path", help="输出目录，默认与原始数据目录相同")
+    generate.add_argument("--compact", action="store_true", help="流式生成紧凑格式（*_for_llm.jsonl）")
+
+    infer = subparsers.add_parser("infer", help="调用GLM API推理测试数据")
+    infer.add_argument("test_data_path")
+    infer.add_argument("--model", default="glm-4-plus")
+    infer.add_argument("--task-description", default="修辞检测")
+    infer.add_argument("--mode", choices=["batch", "async", "http", "auto"], default="async")
+    infer.add_argument("--cache-path", default="saves/response_cache.sqlite")
+    infer.add_argument("--no-cache", action="store_true", help="不使用响应缓存")
+    infer.add_argument("--token-budget", action="store_true", help="按任务类型和输入长度设置max_tokens")
+    infer.add_argument("--pack-size", type=int, default=1)
+    infer.add_argument("--no-metrics", action="store_true", help="不记录请求指标")
+    infer.add_argument("--deadline", type=float, help="auto模式的期望完成秒数")
+    infer.add_argument("--urgent", type=int, default=0, help="auto模式中延迟敏感的前若干条数据")
+    infer.add_argument("--max-attempts", type=int, default=3)
+    infer.add_argument("--sharded", action="store_true", help="按API_KEYS分片到多个进程推理")
+    infer.add_argument("--pipelined", action="store_true", help="逐块推理并随完成写出results.jsonl")
+    infer.add_argument("--hedge", type=float, metavar="QUANTILE", help="async/http模式中耗时超过该分位数（如0.95）的请求再发一份")
+    infer.add_argument("--hedge-budget", type=float, default=0.05, help="对冲请求数占请求总数的上限比例")
+
+    resume_parser = subparsers.add_parser("resume", help="恢复中断的推理")
+    resume_parser.add_argument("work_dir")
+
+    evaluate = subparsers.add_parser("evaluate", help="评估推理结果")
+    evaluate.add_argument("results_path", help="results.json、results.jsonl或其所在的工作目录")
+    evaluate.add_argument("--workers", type=int, default=1, help="评估results.jsonl时使用的进程数")
 
-    result_path = api_infer(model="glm-4.5", test_data_path=test_data_path, task_description="测试分词")
\ No newline at end of file
+    show = subparsers.add_parser("show", help="按下标或custom_id查看results.jsonl中的单条结果")
+    show.add_argument("results_path", help="results.jsonl或其所在的工作目录")
+    show.add_argument("keys", nargs="+", help="输入下标或custom_id（request-<下标>）")
+    return parser
+
+
+def cli(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "generate":
+        generate = genrate_segment_dataset if args.task == "segment" else generate_rhetoric_dataset
+        dataset_path = args.dataset_path or f"{args.task}_data"
+        generate(dataset_path, args.output_path or dataset_path, compact=args.compact)
+    elif args.command == "infer":
+        api_infer(model=args.model, test_data_path=args.test_data_path, task_description=args.task_description,
+                  mode=args.mode, cache_path=None if args.no_cache else args.cache_path, token_budget=args.token_budget,
+                  pack_size=args.pack_size, metrics=not args.no_metrics, deadline=args.deadline, urgent=args.urgent,
+                  max_attempts=args.max_attempts, sharded=args.sharded, pipelined=args.pipelined,
+                  hedge=args.hedge, hedge_budget=args.hedge_budget)
+    elif args.command == "resume":
+        resume(args.work_dir)
+    elif args.command == "evaluate":
+        from evaluate import evaluate_results
+        results_path = args.results_path
+        if os.path.isdir(results_path):
+            # 流水线推理只写出results.jsonl
+            results_json = os.path.join(results_path, "results.json")
+            results_path = results_json if os.path.exists(results_json) else os.path.join(results_path, "results.jsonl")
+        print(evaluate_results(results_path, workers=args.workers))
+    elif args.command == "show":
+        results_path = args.results_path
+        if os.path.isdir(results_path):
+            results_path = os.path.join(results_path, "results.jsonl")
+        with ResultsStore(results_path, readonly=True) as store:
+            for key in args.keys:
+                record = store.get(int(key)) if key.isdigit() else store.get_by_custom_id(key)
+                print(json_dumps(record) if record is not None else f"{key}: 无结果")
+
+
+if __name__ == "__main__":
+    cli()
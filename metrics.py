@@ -0,0 +1,284 @@
+import json
+import threading
+import time
+from typing import Dict, Optional
+
+from polling import LatencyWindow
+from rate_limit import THROTTLED_MESSAGE
+from results import STATUS_TIMEOUT, ItemResult
+
+# 耗时直方图的分桶上界（秒），覆盖HTTP调用的亚秒级到Batch的小时级
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 4 * 3600, 24 * 3600)
+
+
+def error_class(result: ItemResult) -> Optional[str]:
+    """按状态和错误信息归类错误，成功时返回None"""
+    if result.ok:
+        return None
+    if result.status == STATUS_TIMEOUT:
+        return "timeout"
+    error = result.error or ""
+    if error.startswith(("API Error:", "HTTP Error:")):
+        return "throttled" if THROTTLED_MESSAGE in error else "api_error"
+    return "task_failed"
+
+
+class RequestTrace:
+    """
+    单条请求的跟踪记录
+
+    enqueued为进入推理引擎的时刻，submitted为请求被服务端接受的时刻（异步任务提交成功、HTTP请求发出、Batch创建），
+    completed为拿到结果的时刻；queue_time = submitted - enqueued，latency = completed - submitted。
+    流式调用时first_token为收到首个token的时刻，ttft = first_token - submitted。
+    polls为轮询次数，Batch的轮询由其中所有请求共享，按条数均摊。
+    """
+
+    __slots__ = ("mode", "index", "key", "enqueued", "submitted", "first_token", "completed", "polls",
+                 "prompt_tokens", "completion_tokens", "finish_reason", "error")
+
+    def __init__(self, mode: str, index: int, key: Optional[str] = None, enqueued: Optional[float] = None):
+        self.mode = mode
+        self.index = index
+        self.key = key
+        self.enqueued = enqueued if enqueued is not None else time.time()
+        self.submitted = None
+        self.first_token = None
+        self.completed = None
+        self.polls = 0
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.finish_reason = None
+        self.error = None
+
+    @property
+    def queue_time(self) -> Optional[float]:
+        return self.submitted - self.enqueued if self.submitted is not None else None
+
+    @property
+    def ttft(self) -> Optional[float]:
+        if self.submitted is None or self.first_token is None:
+            return None
+        return self.first_token - self.submitted
+
+    @property
+    def latency(self) -> Optional[float]:
+        if self.submitted is None or self.completed is None:
+            return None
+        return self.completed - self.submitted
+
+    def set_usage(self, usage, finish_reason: Optional[str] = None):
+        """记录token用量，usage可以是SDK对象或dict"""
+        if usage is not None:
+            if isinstance(usage, dict):
+                self.prompt_tokens = usage.get('prompt_tokens')
+                self.completion_tokens = usage.get('completion_tokens')
+            else:
+                self.prompt_tokens = getattr(usage, 'prompt_tokens', None)
+                self.completion_tokens = getattr(usage, 'completion_tokens', None)
+        self.finish_reason = finish_reason
+
+    def to_dict(self) -> dict:
+        return {
+            "mode": self.mode,
+            "index": self.index,
+            "key": self.key,
+            "enqueued": self.enqueued,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "queue_time": self.queue_time,
+            "latency": self.latency,
+            "ttft": self.ttft,
+            "polls": round(self.polls, 3),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "finish_reason": self.finish_reason,
+            "error": self.error,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RequestTrace":
+        """由to_dict的输出还原，用于汇总其他进程（如分片推理的工作进程）中记录的请求"""
+        trace = cls(data["mode"], data["index"], data.get("key"), data["enqueued"])
+        trace.submitted = data.get("submitted")
+        trace.completed = data.get("completed")
+        if data.get("ttft") is not None and trace.submitted is not None:
+            trace.first_token = trace.submitted + data["ttft"]
+        trace.polls = data.get("polls", 0)
+        trace.prompt_tokens = data.get("prompt_tokens")
+        trace.completion_tokens = data.get("completion_tokens")
+        trace.finish_reason = data.get("finish_reason")
+        trace.error = data.get("error")
+        return trace
+
+
+class _ModeStats:
+    """单个推理模式的聚合指标"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors: Dict[str, int] = {}
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.latencies = LatencyWindow(size=10000)
+        self.queue_time_sum = 0.0
+        self.ttft_sum = 0.0
+        self.ttft_count = 0
+        self.polls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.truncated = 0
+        self.first_enqueued = None
+        self.last_completed = None
+
+    def add(self, trace: RequestTrace):
+        self.requests += 1
+        if trace.error is not None:
+            self.errors[trace.error] = self.errors.get(trace.error, 0) + 1
+        latency = trace.latency
+        if latency is not None:
+            self.latency_sum += latency
+            self.latency_count += 1
+            self.latencies.add(latency)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    self.bucket_counts[i] += 1
+        if trace.queue_time is not None:
+            self.queue_time_sum += trace.queue_time
+        ttft = trace.ttft
+        if ttft is not None:
+            self.ttft_sum += ttft
+            self.ttft_count += 1
+        self.polls += trace.polls
+        self.prompt_tokens += trace.prompt_tokens or 0
+        self.completion_tokens += trace.completion_tokens or 0
+        self.truncated += trace.finish_reason == "length"
+        if self.first_enqueued is None or trace.enqueued < self.first_enqueued:
+            self.first_enqueued = trace.enqueued
+        if self.last_completed is None or trace.completed > self.last_completed:
+            self.last_completed = trace.completed
+
+    def snapshot(self) -> dict:
+        wall_time = self.last_completed - self.first_enqueued if self.requests else None
+        return {
+            "requests": self.requests,
+            "wall_time": wall_time,
+            "throughput": self.requests / wall_time if wall_time else None,
+            "errors": dict(self.errors),
+            "latency_mean": self.latency_sum / self.latency_count if self.latency_count else None,
+            "latency_p50": self.latencies.quantile(0.5),
+            "latency_p90": self.latencies.quantile(0.9),
+            "latency_p99": self.latencies.quantile(0.99),
+            "queue_time_mean": self.queue_time_sum / self.requests if self.requests else None,
+            "ttft_mean": self.ttft_sum / self.ttft_count if self.ttft_count else None,
+            "polls": round(self.polls, 3),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "truncated": self.truncated,
+        }
+
+
+class MetricsRecorder:
+    """
+    GLMAPI的逐条请求指标采集
+
+    推理引擎在每条请求开始时调用start取得RequestTrace，过程中填入提交时刻、轮询次数和token用量，
+    完成时调用finish：按推理模式汇总计数、错误分类、耗时直方图和token用量，并可把每条记录追加写入trace文件（JSONL）。
+    汇总结果可通过snapshot()（JSON）或to_prometheus()（Prometheus文本格式）导出。
+    GLMAPI未设置metrics时不创建任何跟踪记录。
+    """
+
+    def __init__(self, trace_path: Optional[str] = None):
+        """
+        Args:
+            trace_path: 逐条请求记录的输出路径（JSONL），为None时只做汇总
+        """
+        self.trace_path = trace_path
+        self._trace_file = open(trace_path, "a", encoding="utf-8") if trace_path else None
+        self._modes: Dict[str, _ModeStats] = {}
+        self._lock = threading.Lock()
+
+    def start(self, mode: str, index: int, key: Optional[str] = None, enqueued: Optional[float] = None) -> RequestTrace:
+        return RequestTrace(mode, index, key, enqueued)
+
+    def finish(self, trace: RequestTrace, result: ItemResult):
+        """记录一条请求的最终结果"""
+        if trace.completed is None:
+            trace.completed = time.time()
+        trace.error = error_class(result)
+        self.add(trace)
+
+    def add(self, trace: RequestTrace):
+        """汇总一条已结束的请求记录（finish已填入完成时刻和错误分类）"""
+        line = json.dumps(trace.to_dict(), ensure_ascii=False) + "\n" if self._trace_file is not None else None
+        with self._lock:
+            stats = self._modes.get(trace.mode)
+            if stats is None:
+                stats = self._modes[trace.mode] = _ModeStats()
+            stats.add(trace)
+            if line is not None:
+                self._trace_file.write(line)
+
+    def snapshot(self) -> dict:
+        """按推理模式汇总的指标"""
+        with self._lock:
+            return {mode: stats.snapshot() for mode, stats in self._modes.items()}
+
+    def to_prometheus(self) -> str:
+        """以Prometheus文本格式导出汇总指标"""
+        lines = [
+            "# HELP glm_requests_total Requests completed by GLMAPI.",
+            "# TYPE glm_requests_total counter",
+        ]
+        with self._lock:
+            modes = list(self._modes.items())
+            for mode, stats in modes:
+                lines.append(f'glm_requests_total{{mode="{mode}"}} {stats.requests}')
+            lines += ["# HELP glm_request_errors_total Failed requests by error class.",
+                      "# TYPE glm_request_errors_total counter"]
+            for mode, stats in modes:
+                for error, count in sorted(stats.errors.items()):
+                    lines.append(f'glm_request_errors_total{{mode="{mode}",error="{error}"}} {count}')
+            lines += ["# HELP glm_request_latency_seconds Time from submission to result.",
+                      "# TYPE glm_request_latency_seconds histogram"]
+            for mode, stats in modes:
+                for bound, count in zip(LATENCY_BUCKETS, stats.bucket_counts):
+                    lines.append(f'glm_request_latency_seconds_bucket{{mode="{mode}",le="{bound}"}} {count}')
+                lines.append(f'glm_request_latency_seconds_bucket{{mode="{mode}",le="+Inf"}} {stats.latency_count}')
+                lines.append(f'glm_request_latency_seconds_sum{{mode="{mode}"}} {stats.latency_sum}')
+                lines.append(f'glm_request_latency_seconds_count{{mode="{mode}"}} {stats.latency_count}')
+            lines += ["# HELP glm_queue_time_seconds_sum Total time requests waited before submission.",
+                      "# TYPE glm_queue_time_seconds_sum counter"]
+            for mode, stats in modes:
+                lines.append(f'glm_queue_time_seconds_sum{{mode="{mode}"}} {stats.queue_time_sum}')
+            lines += ["# HELP glm_time_to_first_token_seconds Time from submission to the first streamed token.",
+                      "# TYPE glm_time_to_first_token_seconds summary"]
+            for mode, stats in modes:
+                if stats.ttft_count:
+                    lines.append(f'glm_time_to_first_token_seconds_sum{{mode="{mode}"}} {stats.ttft_sum}')
+                    lines.append(f'glm_time_to_first_token_seconds_count{{mode="{mode}"}} {stats.ttft_count}')
+            lines += ["# HELP glm_polls_total Status polls issued.",
+                      "# TYPE glm_polls_total counter"]
+            for mode, stats in modes:
+                lines.append(f'glm_polls_total{{mode="{mode}"}} {stats.polls}')
+            lines += ["# HELP glm_tokens_total Token usage reported by the API.",
+                      "# TYPE glm_tokens_total counter"]
+            for mode, stats in modes:
+                lines.append(f'glm_tokens_total{{mode="{mode}",type="prompt"}} {stats.prompt_tokens}')
+                lines.append(f'glm_tokens_total{{mode="{mode}",type="completion"}} {stats.completion_tokens}')
+        return "\n".join(lines) + "\n"
+
+    def save(self, json_path: Optional[str] = None, prometheus_path: Optional[str] = None):
+        """将汇总指标写入JSON和/或Prometheus文本文件"""
+        if json_path:
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        if prometheus_path:
+            with open(prometheus_path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+
+    def close(self):
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
@@ -0,0 +1,477 @@
+import argparse
+import email
+import heapq
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional
+
+_ANSWER_MARKER = re.compile(r"【(\d+)】")
+
+
+def _rhetoric_answer(seed: int) -> str:
+    return "是，该句含有修辞手法。" if seed % 2 else "否，该句没有使用修辞手法。"
+
+
+def mock_reply(content: str) -> str:
+    """
+    根据用户消息生成确定性的模拟回复
+
+    修辞识别请求回答“是/否，……”；打包请求（含【编号】标记）按编号逐行回答，便于测试packing对齐；
+    其余请求回显输入末尾。
+    """
+    rhetoric = "是否使用了修辞手法" in content
+    numbers = list(dict.fromkeys(_ANSWER_MARKER.findall(content)))
+    if numbers:
+        return "\n".join(
+            f"【{number}】{_rhetoric_answer(int(number)) if rhetoric else f'模拟答案{number}'}" for number in numbers
+        )
+    if rhetoric:
+        return _rhetoric_answer(len(content))
+    return f"模拟回复：{content[-20:]}"
+
+
+class MockGLMServer:
+    """
+    本地模拟的智谱GLM API服务，用于在不消耗额度的情况下测试和压测GLMAPI的三种推理模式
+
+    实现客户端用到的接口（路径与 https://open.bigmodel.cn/api/paas/v4 下一致）：
+    - POST /chat/completions：同步调用，按模拟耗时阻塞后返回；请求中stream为true时以SSE逐字返回
+    - POST /async/chat/completions、GET /async-result/{id}：异步任务，模拟耗时后变为SUCCESS
+    - POST /files、GET /files/{id}/content：上传batch文件、下载结果文件
+    - POST /batches、GET /batches/{id}：Batch任务，batch_turnaround秒内按时间线性推进进度
+    另有 GET /_stats 返回各接口调用次数和每条请求的观测耗时，POST /_reset 清空统计。
+
+    观测耗时指服务端视角下客户端拿到结果的耗时：同步调用为请求处理时长，
+    异步任务为提交到首次查询到SUCCESS，Batch为创建到下载结果文件，因此包含轮询带来的额外等待。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_median: float = 1.0,
+                 latency_sigma: float = 0.5, failure_rate: float = 0.0, throttle_rate: float = 0.0,
+                 max_concurrency: int = 0, batch_turnaround: float = 10.0, token_interval: float = 0.0,
+                 seed: Optional[int] = None, straggler_rate: float = 0.0, straggler_factor: float = 10.0):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口，0表示随机选择空闲端口
+            latency_median: 单条请求耗时的中位数（秒）
+            latency_sigma: 耗时对数正态分布的sigma，0表示固定耗时
+            failure_rate: 请求失败的概率（同步调用返回500，异步任务返回FAIL，Batch请求写入错误文件）
+            throttle_rate: 提交请求时随机返回429的概率
+            max_concurrency: 同时在途的同步调用和异步任务数超过该值时返回429（错误码1302），0表示不限制
+            batch_turnaround: Batch从创建到完成的秒数
+            token_interval: 同步调用生成每个字的秒数，模拟耗时为首字耗时，之后逐字增加
+            seed: 随机种子
+            straggler_rate: 请求成为慢请求（落后者）的概率，用于模拟长尾
+            straggler_factor: 慢请求的耗时倍数
+        """
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.max_concurrency = max_concurrency
+        self.batch_turnaround = batch_turnaround
+        self.token_interval = token_interval
+        self.straggler_rate = straggler_rate
+        self.straggler_factor = straggler_factor
+        self._random = random.Random(seed)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.tasks: Dict[str, dict] = {}
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, dict] = {}
+        self._http_in_flight = 0
+        self._pending_ready: List[float] = []  # 未完成异步任务的完成时刻（小顶堆）
+        self.reset_stats()
+
+        self.httpd = _QuietHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """可直接作为GLMAPI的api_base"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockGLMServer":
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def serve_forever(self):
+        print(f"模拟GLM服务已启动: {self.url}")
+        self.httpd.serve_forever()
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls: Dict[str, int] = {}
+            self.latencies: List[float] = []
+            self.throttled = 0
+            self.peak_concurrency = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "latencies": list(self.latencies),
+                "throttled": self.throttled,
+                "peak_concurrency": self.peak_concurrency,
+            }
+
+    # ---------- 模拟行为 ----------
+
+    def _new_id(self, prefix: str) -> str:
+        return f"{prefix}-{next(self._ids)}"
+
+    def _sample_latency(self) -> float:
+        latency = self.latency_median
+        if self.latency_sigma > 0:
+            latency *= self._random.lognormvariate(0, self.latency_sigma)
+        if self.straggler_rate > 0 and self._random.random() < self.straggler_rate:
+            latency *= self.straggler_factor
+        return latency
+
+    def _in_flight(self, now: float) -> int:
+        """当前在途的同步调用和未完成的异步任务数"""
+        while self._pending_ready and self._pending_ready[0] <= now:
+            heapq.heappop(self._pending_ready)
+        return self._http_in_flight + len(self._pending_ready)
+
+    def _admit(self) -> bool:
+        """判断是否接受一次提交，被限流时返回False（调用方需持有self._lock）"""
+        if self._random.random() < self.throttle_rate or (
+                self.max_concurrency and self._in_flight(time.time()) >= self.max_concurrency):
+            self.throttled += 1
+            return False
+        return True
+
+    def _completion(self, body: dict) -> dict:
+        """按请求体生成一条chat completion结果"""
+        messages = body.get("messages") or [{}]
+        content = messages[-1].get("content", "")
+        reply = mock_reply(content)
+        finish_reason = "stop"
+        max_tokens = body.get("max_tokens")
+        if max_tokens is not None and len(reply) > max_tokens:
+            reply, finish_reason = reply[:max_tokens], "length"
+        prompt_tokens = sum(len(message.get("content", "")) for message in messages)
+        return {
+            "id": self._new_id("chatcmpl"),
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": finish_reason,
+                "message": {"role": "assistant", "content": reply},
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(reply),
+                "total_tokens": prompt_tokens + len(reply),
+            },
+        }
+
+    def _batch_view(self, batch: dict, now: float) -> dict:
+        """按已过时间推进Batch进度，到期时生成结果文件，返回Batch对象"""
+        total = len(batch["requests"])
+        progress = min((now - batch["created"]) / self.batch_turnaround, 1.0) if self.batch_turnaround > 0 else 1.0
+        completed = int(total * progress)
+        failed = sum(batch["failures"][:completed])
+        if progress >= 1.0 and batch["status"] != "completed":
+            lines, errors = [], []
+            for request, failure in zip(batch["requests"], batch["failures"]):
+                if failure:
+                    errors.append(json.dumps({
+                        "custom_id": request.get("custom_id"),
+                        "response": {"status_code": 500, "body": _error("500", "模拟的服务端错误")},
+                    }, ensure_ascii=False))
+                    continue
+                result = {
+                    "custom_id": request.get("custom_id"),
+                    "response": {"status_code": 200, "body": self._completion(request.get("body", {}))},
+                }
+                lines.append(json.dumps(result, ensure_ascii=False))
+            output_file_id = self._new_id("file")
+            self.files[output_file_id] = ("\n".join(lines) + "\n").encode("utf-8")
+            batch.update(status="completed", output_file_id=output_file_id, completed_at=int(now * 1000))
+            if errors:
+                # 失败的请求写入单独的错误文件
+                batch["error_file_id"] = self._new_id("file")
+                self.files[batch["error_file_id"]] = ("\n".join(errors) + "\n").encode("utf-8")
+        return {
+            "id": batch["id"],
+            "object": "batch",
+            "endpoint": batch["endpoint"],
+            "input_file_id": batch["input_file_id"],
+            "completion_window": "24h",
+            "status": batch["status"],
+            "output_file_id": batch.get("output_file_id"),
+            "error_file_id": batch.get("error_file_id"),
+            # 时间戳以毫秒为单位
+            "created_at": int(batch["created"] * 1000),
+            "completed_at": batch.get("completed_at"),
+            "metadata": batch["metadata"],
+            "request_counts": {"total": total, "completed": completed - failed, "failed": failed},
+        }
+
+    # ---------- 接口实现，返回 (状态码, 响应体) ----------
+
+    def handle(self, method: str, path: str, headers, body: bytes):
+        self._count(method, path)
+        if method == "POST" and path == "/chat/completions":
+            return self._chat_completions(json.loads(body))
+        if method == "POST" and path == "/async/chat/completions":
+            return self._async_create(json.loads(body))
+        if method == "GET" and path.startswith("/async-result/"):
+            return self._async_result(path.rsplit("/", 1)[1])
+        if method == "POST" and path == "/files":
+            return self._upload_file(headers.get("Content-Type", ""), body)
+        if method == "GET" and path.startswith("/files/") and path.endswith("/content"):
+            return self._file_content(path.split("/")[2])
+        if method == "POST" and path == "/batches":
+            return self._create_batch(json.loads(body))
+        if method == "GET" and path.startswith("/batches/"):
+            return self._retrieve_batch(path.rsplit("/", 1)[1])
+        if method == "GET" and path == "/_stats":
+            return 200, self.stats()
+        if method == "POST" and path == "/_reset":
+            self.reset_stats()
+            return 200, {}
+        return 404, _error("404", f"Unknown endpoint: {method} {path}")
+
+    def _count(self, method: str, path: str):
+        # 去掉路径中的ID，按接口汇总调用次数
+        endpoint = f"{method} " + re.sub(r"/[^/]*-\d+", "/{id}", path)
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def _chat_completions(self, body: dict):
+        start = time.time()
+        with self._lock:
+            if not self._admit():
+                return 429, _error("1302", "您当前使用该API的并发数过高，请降低并发")
+            self._http_in_flight += 1
+            self.peak_concurrency = max(self.peak_concurrency, self._in_flight(start))
+            latency = self._sample_latency()
+            failed = self._random.random() < self.failure_rate
+        completion = self._completion(body)
+        if body.get("stream") and not failed:
+            return 200, self._stream(completion, latency, start)
+        try:
+            reply = completion["choices"][0]["message"]["content"]
+            time.sleep(latency + len(reply) * self.token_interval)
+        finally:
+            self._end_call(start)
+        if failed:
+            return 500, _error("500", "模拟的服务端错误")
+        return 200, completion
+
+    def _end_call(self, start: float):
+        with self._lock:
+            self._http_in_flight -= 1
+            self.latencies.append(time.time() - start)
+
+    def _stream(self, completion: dict, latency: float, start: float) -> Iterator[bytes]:
+        """以SSE逐字返回completion，客户端提前断开时生成器随之关闭"""
+        try:
+            time.sleep(latency)
+            choice = completion["choices"][0]
+            for char in choice["message"]["content"]:
+                yield _sse({"id": completion["id"], "choices": [{"index": 0, "delta": {"role": "assistant", "content": char}}]})
+                time.sleep(self.token_interval)
+            yield _sse({"id": completion["id"], "usage": completion["usage"],
+                        "choices": [{"index": 0, "finish_reason": choice["finish_reason"], "delta": {}}]})
+            yield b"data: [DONE]\n\n"
+        finally:
+            self._end_call(start)
+
+    def _async_create(self, body: dict):
+        now = time.time()
+        with self._lock:
+            if not self._admit():
+                return 429, _error("1302", "您当前使用该API的并发数过高，请降低并发")
+            task_id = self._new_id("task")
+            self.tasks[task_id] = {
+                "body": body,
+                "submitted": now,
+                "ready_at": now + self._sample_latency(),
+                "failed": self._random.random() < self.failure_rate,
+                "observed": False,
+            }
+            heapq.heappush(self._pending_ready, self.tasks[task_id]["ready_at"])
+            self.peak_concurrency = max(self.peak_concurrency, self._in_flight(now))
+        return 200, {"id": task_id, "model": body.get("model"), "task_status": "PROCESSING"}
+
+    def _async_result(self, task_id: str):
+        now = time.time()
+        with self._lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return 404, _error("1214", f"任务不存在: {task_id}")
+            if task["ready_at"] > now:
+                return 200, {"id": task_id, "task_status": "PROCESSING"}
+            if not task["observed"]:
+                task["observed"] = True
+                self.latencies.append(now - task["submitted"])
+        if task["failed"]:
+            return 200, {"id": task_id, "task_status": "FAIL"}
+        result = self._completion(task["body"])
+        result.update(id=task_id, task_status="SUCCESS")
+        return 200, result
+
+    def _upload_file(self, content_type: str, body: bytes):
+        # 用email解析multipart/form-data，取出file字段
+        message = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body)
+        data = None
+        for part in message.walk():
+            if part.get_param("name", header="content-disposition") == "file":
+                data = part.get_payload(decode=True)
+        if data is None:
+            return 400, _error("1210", "缺少file字段")
+        with self._lock:
+            file_id = self._new_id("file")
+            self.files[file_id] = data
+        return 200, {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                     "filename": "batch.jsonl", "purpose": "batch"}
+
+    def _file_content(self, file_id: str):
+        with self._lock:
+            data = self.files.get(file_id)
+            # Batch结果文件首次被下载时记录该Batch每条请求的观测耗时
+            for batch in self.batches.values():
+                if batch.get("output_file_id") == file_id and not batch["observed"]:
+                    batch["observed"] = True
+                    self.latencies.extend([time.time() - batch["created"]] * len(batch["requests"]))
+        if data is None:
+            return 404, _error("1214", f"文件不存在: {file_id}")
+        return 200, data
+
+    def _create_batch(self, body: dict):
+        with self._lock:
+            data = self.files.get(body.get("input_file_id"))
+            if data is None:
+                return 400, _error("1214", "input_file_id不存在")
+            requests = [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+            batch = {
+                "id": self._new_id("batch"),
+                "endpoint": body.get("endpoint"),
+                "input_file_id": body.get("input_file_id"),
+                "metadata": body.get("metadata"),
+                "created": time.time(),
+                "status": "in_progress",
+                "requests": requests,
+                "failures": [self._random.random() < self.failure_rate for _ in requests],
+                "observed": False,
+            }
+            self.batches[batch["id"]] = batch
+            return 200, self._batch_view(batch, batch["created"])
+
+    def _retrieve_batch(self, batch_id: str):
+        with self._lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return 404, _error("1214", f"Batch不存在: {batch_id}")
+            return 200, self._batch_view(batch, time.time())
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # 使用HTTP/1.1以支持keep-alive连接复用
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                path = self.path.split("?", 1)[0]
+                try:
+                    status, payload = server.handle(method, path, self.headers, body)
+                except Exception as e:
+                    status, payload = 500, _error("500", str(e))
+                if not isinstance(payload, (bytes, dict)):
+                    self._send_stream(status, payload)
+                    return
+                if isinstance(payload, bytes):
+                    data, content_type = payload, "application/octet-stream"
+                else:
+                    data, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, status: int, chunks: Iterator[bytes]):
+                """以分块传输编码发送SSE，保持连接可复用"""
+                self.send_response(status)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for chunk in chunks:
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                        self.wfile.flush()
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前停止接收
+                    self.close_connection = True
+                finally:
+                    chunks.close()
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    """客户端关闭连接（如关闭连接池、提前停止流式接收）时不打印异常"""
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def _error(code: str, message: str) -> dict:
+    return {"error": {"code": code, "message": message}}
+
+
+def _sse(event: dict) -> bytes:
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟的智谱GLM API服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-median", type=float, default=1.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=int, default=0)
+    parser.add_argument("--batch-turnaround", type=float, default=10.0)
+    parser.add_argument("--token-interval", type=float, default=0.0)
+    parser.add_argument("--straggler-rate", type=float, default=0.0)
+    parser.add_argument("--straggler-factor", type=float, default=10.0)
+    args = parser.parse_args()
+    MockGLMServer(args.host, args.port, args.latency_median, args.latency_sigma, args.failure_rate,
+                  args.throttle_rate, args.max_concurrency, args.batch_turnaround, args.token_interval,
+                  straggler_rate=args.straggler_rate, straggler_factor=args.straggler_factor).serve_forever()
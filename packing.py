@@ -0,0 +1,61 @@
+import re
+from typing import Dict, List, Tuple
+
+from instructions import PACKED_INSTRUCTION
+
+_ANSWER_MARKER = re.compile(r"【(\d+)】")
+
+
+def pack_items(infer_data: List, pack_size: int) -> Tuple[List[dict], List[List[int]]]:
+    """
+    将相邻且system/instruction相同的输入每pack_size条打包成一个请求
+
+    Returns:
+        (打包后的请求列表, 每个请求包含的原始输入下标)
+    """
+    packs, members = [], []
+    group: List[int] = []
+
+    def flush():
+        if not group:
+            return
+        first = infer_data[group[0]]
+        inputs = "\n".join(f"【{j + 1}】{infer_data[i].get('input', '').strip()}" for j, i in enumerate(group))
+        packs.append({
+            "system": first.get('system', ''),
+            "instruction": first.get('instruction', '') + PACKED_INSTRUCTION.format(count=len(group)),
+            "input": inputs,
+            "pack_size": len(group),
+        })
+        members.append(list(group))
+        group.clear()
+
+    for i, item in enumerate(infer_data):
+        if group:
+            head = infer_data[group[0]]
+            if (len(group) >= pack_size or item.get('system', '') != head.get('system', '')
+                    or item.get('instruction', '') != head.get('instruction', '')):
+                flush()
+        group.append(i)
+    flush()
+    return packs, members
+
+
+def parse_packed_reply(reply: str, count: int) -> Dict[int, str]:
+    """
+    按【编号】拆分打包请求的回复，返回 {编号(从1开始): 答案}
+
+    只返回能唯一对齐的编号：超出范围、重复出现或答案为空的编号都不返回，由调用方单独重跑。
+    """
+    parts = _ANSWER_MARKER.split(reply)
+    answers: Dict[int, str] = {}
+    duplicated = set()
+    # split结果为 [前缀, 编号, 答案, 编号, 答案, ...]
+    for number, answer in zip(parts[1::2], parts[2::2]):
+        number = int(number)
+        if not 1 <= number <= count:
+            continue
+        if number in answers:
+            duplicated.add(number)
+        answers[number] = answer.strip()
+    return {number: answer for number, answer in answers.items() if answer and number not in duplicated}
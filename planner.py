@@ -0,0 +1,169 @@
+import json
+import os
+from typing import List, Optional, Tuple
+
+# 不支持批处理的模型
+BATCH_UNSUPPORTED_MODELS = ("glm-4.5",)
+
+# 各模式相对单价，Batch按在线调用的五折计费
+MODE_COST = {"http": 1.0, "async": 1.0, "batch": 0.5}
+
+# 未测量时使用的默认性能估计：
+# items_per_sec为稳定吞吐（受limiter并发上限约束），latency为首条结果的固定开销（秒）
+DEFAULT_PROFILE = {
+    "http": {"items_per_sec": 4.0, "latency": 5.0},
+    "async": {"items_per_sec": 4.0, "latency": 10.0},
+    "batch": {"items_per_sec": 50.0, "latency": 2 * 3600.0},
+}
+
+
+class DispatchPlan:
+    """
+    推理模式的分派方案
+
+    parts为 [(模式, 起始下标, 结束下标)]，各部分是输入数据中互不重叠的连续区间，同时执行。
+    """
+
+    def __init__(self, parts: List[Tuple[str, int, int]], predicted_seconds: float, cost: float, reason: str):
+        self.parts = parts
+        self.predicted_seconds = predicted_seconds
+        self.cost = cost
+        self.reason = reason
+
+    def describe(self) -> str:
+        parts = "，".join(f"{mode}[{start}:{stop}] {stop - start}条" for mode, start, stop in self.parts)
+        return f"{parts}；预计 {self.predicted_seconds:.0f} 秒完成，相对成本 {self.cost:.1f}（{self.reason}）"
+
+    def to_dict(self) -> dict:
+        return {
+            "parts": [list(part) for part in self.parts],
+            "predicted_seconds": self.predicted_seconds,
+            "cost": self.cost,
+            "reason": self.reason,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DispatchPlan":
+        return cls([tuple(part) for part in data["parts"]], data["predicted_seconds"], data["cost"], data["reason"])
+
+
+class DispatchPlanner:
+    """
+    按数据量、模型能力、截止时间和实测吞吐选择推理模式
+
+    规则：
+    - 前urgent条为延迟敏感数据，始终走在线模式（数量不超过http_max_items时用http，否则用async）
+    - 其余数据没有截止时间时优先选成本最低的Batch（模型不支持或数据太少时改走在线模式）
+    - 有截止时间时在 单一模式 和 async+Batch拆分 中选择能按时完成且成本最低的方案，
+      都无法按时完成时选择预计完成最早的方案
+    http与async共享同一个limiter，因此不在二者之间拆分。
+
+    各模式的吞吐和固定开销取自profile，可由update_from_metrics按实际运行的指标更新并保存，
+    下次运行时使用实测值。
+    """
+
+    def __init__(self, profile_path: Optional[str] = "saves/mode_profile.json", batch_min_items: int = 100,
+                 http_max_items: int = 50, smoothing: float = 0.5):
+        """
+        Args:
+            profile_path: 实测性能的保存路径，为None时只使用默认估计
+            batch_min_items: 少于该条数时不使用Batch
+            http_max_items: 不超过该条数的在线请求使用http，否则使用async
+            smoothing: 用新测量值更新profile时的权重
+        """
+        self.profile_path = profile_path
+        self.batch_min_items = batch_min_items
+        self.http_max_items = http_max_items
+        self.smoothing = smoothing
+        self.profile = {mode: dict(values) for mode, values in DEFAULT_PROFILE.items()}
+        if profile_path and os.path.exists(profile_path):
+            with open(profile_path, "r", encoding="utf-8") as f:
+                for mode, values in json.load(f).items():
+                    self.profile.setdefault(mode, {}).update(values)
+
+    def predict(self, mode: str, count: int) -> float:
+        """预计mode处理count条数据的耗时（秒）"""
+        if count <= 0:
+            return 0.0
+        profile = self.profile[mode]
+        return profile["latency"] + count / profile["items_per_sec"]
+
+    def _online_mode(self, count: int) -> str:
+        return "http" if count <= self.http_max_items else "async"
+
+    def plan(self, total: int, model: str, deadline: Optional[float] = None, urgent: int = 0) -> DispatchPlan:
+        """
+        Args:
+            total: 数据条数
+            model: 模型名称，用于判断是否支持Batch
+            deadline: 期望在多少秒内完成，None表示不限
+            urgent: 前多少条数据为延迟敏感数据
+        """
+        urgent = min(max(urgent, 0), total)
+        rest = total - urgent
+        batch_ok = model not in BATCH_UNSUPPORTED_MODELS and rest >= self.batch_min_items
+
+        # 候选方案：剩余数据中前k条与urgent数据一起走在线模式，其余走Batch
+        candidates = []
+        if batch_ok:
+            candidates.append((urgent, "全部非紧急数据走Batch"))
+            split = self._split_point(urgent, rest)
+            if deadline is not None and 0 < split < rest:
+                candidates.append((urgent + split, "在线模式与Batch同时处理，使两者同时完成"))
+            candidates.append((total, "全部数据走在线模式"))
+        elif model in BATCH_UNSUPPORTED_MODELS:
+            candidates.append((total, f"{model}不支持Batch，全部数据走在线模式"))
+        else:
+            candidates.append((total, f"非紧急数据不足{self.batch_min_items}条，全部走在线模式"))
+
+        plans = [self._build(online, total, reason) for online, reason in candidates]
+        if deadline is None:
+            return min(plans, key=lambda p: (p.cost, p.predicted_seconds))
+        on_time = [p for p in plans if p.predicted_seconds <= deadline]
+        if on_time:
+            return min(on_time, key=lambda p: (p.cost, p.predicted_seconds))
+        best = min(plans, key=lambda p: p.predicted_seconds)
+        best.reason += f"；所有方案都无法在 {deadline:.0f} 秒内完成，选择最快的方案"
+        return best
+
+    def _split_point(self, urgent: int, rest: int) -> int:
+        """二分查找剩余数据中分给在线模式的条数k，使在线部分与Batch部分的预计完成时间最接近"""
+        lo, hi = 0, rest
+        while lo < hi:
+            k = (lo + hi) // 2
+            online = urgent + k
+            if self.predict(self._online_mode(online), online) < self.predict("batch", rest - k):
+                lo = k + 1
+            else:
+                hi = k
+        return lo
+
+    def _build(self, online: int, total: int, reason: str) -> DispatchPlan:
+        """前online条走在线模式，其余走Batch"""
+        parts = []
+        online_mode = self._online_mode(online)
+        if online > 0:
+            parts.append((online_mode, 0, online))
+        if total > online:
+            parts.append(("batch", online, total))
+        predicted = max((self.predict(mode, stop - start) for mode, start, stop in parts), default=0.0)
+        cost = sum(MODE_COST[mode] * (stop - start) for mode, start, stop in parts) / max(total, 1)
+        return DispatchPlan(parts, predicted, cost, reason)
+
+    def update_from_metrics(self, snapshot: dict):
+        """用MetricsRecorder.snapshot()中各模式的实测吞吐和耗时更新profile并保存"""
+        for mode, stats in snapshot.items():
+            if mode not in self.profile or not stats.get("throughput") or stats.get("latency_p50") is None:
+                continue
+            profile = self.profile[mode]
+            if mode == "batch":
+                # Batch的耗时以固定开销为主，只更新latency
+                measured = {"latency": stats["latency_p50"]}
+            else:
+                measured = {"items_per_sec": stats["throughput"], "latency": stats["latency_p50"]}
+            for name, value in measured.items():
+                profile[name] += (value - profile[name]) * self.smoothing
+        if self.profile_path:
+            os.makedirs(os.path.dirname(self.profile_path) or ".", exist_ok=True)
+            with open(self.profile_path, "w", encoding="utf-8") as f:
+                json.dump(self.profile, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,128 @@
+import bisect
+import random
+import threading
+from collections import deque
+from typing import Optional
+
+
+class LatencyWindow:
+    """最近N次完成耗时的滑动窗口，维护有序副本以便O(log n)查询分位数"""
+
+    def __init__(self, size: int = 1000):
+        self._window = deque()
+        self._sorted = []
+        self.size = size
+        self._lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self._lock:
+            self._window.append(latency)
+            bisect.insort(self._sorted, latency)
+            if len(self._window) > self.size:
+                oldest = self._window.popleft()
+                del self._sorted[bisect.bisect_left(self._sorted, oldest)]
+
+    def quantile(self, q: float) -> Optional[float]:
+        """返回分位数q（0~1）对应的耗时，无样本时返回None"""
+        with self._lock:
+            if not self._sorted:
+                return None
+            pos = min(int(q * len(self._sorted)), len(self._sorted) - 1)
+            return self._sorted[pos]
+
+    def __len__(self):
+        return len(self._window)
+
+
+class PollScheduler:
+    """
+    异步任务轮询调度
+
+    有足够的已完成样本时，依次在已观测耗时的 p50、p75、p87.5…… 分位点轮询，每次预期能捕获剩余任务的一半；
+    超出已观测范围（或样本不足）时按已等待时间做指数退避，即下次轮询时刻为 elapsed * backoff。
+    每次延迟带随机抖动以避免请求扎堆。
+    """
+
+    def __init__(self, initial_delay: float = 1.0, min_delay: float = 0.1, max_delay: float = 30.0,
+                 backoff: float = 1.5, jitter: float = 0.2, min_samples: int = 5):
+        """
+        Args:
+            initial_delay: 退避的最小步长，也是无历史耗时时首次轮询的等待秒数
+            min_delay: 单次等待的下限
+            max_delay: 单次等待的上限
+            backoff: 退避倍率
+            jitter: 抖动比例，实际延迟在 [1-jitter, 1+jitter] 倍之间
+            min_samples: 样本数达到该值后才按分位点轮询
+        """
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.jitter = jitter
+        self.min_samples = min_samples
+        self.latencies = LatencyWindow()
+        self.poll_calls = 0
+
+    def expected_latency(self, q: float = 0.5) -> Optional[float]:
+        """已观测耗时的分位数，样本不足时返回None"""
+        if len(self.latencies) < self.min_samples:
+            return None
+        return self.latencies.quantile(q)
+
+    def next_delay(self, elapsed: float, overdue_polls: int) -> float:
+        """
+        计算下一次轮询前的等待秒数
+
+        Args:
+            elapsed: 任务自提交起已经过的秒数
+            overdue_polls: 该任务已轮询但未完成的次数
+        """
+        target = self.expected_latency(1 - 0.5 ** (overdue_polls + 1))
+        if target is not None and target > elapsed:
+            delay = target - elapsed
+        else:
+            delay = max(self.initial_delay, elapsed * (self.backoff - 1))
+        delay = min(max(delay, self.min_delay), self.max_delay)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def record_poll(self):
+        self.poll_calls += 1
+
+    def record_latency(self, latency: float):
+        """记录一个任务从提交到观测完成的耗时"""
+        self.latencies.add(latency)
+
+
+class BatchPollScheduler:
+    """
+    Batch任务轮询调度
+
+    有进度时按已完成数量估算处理速率，在预计完成时刻附近轮询；
+    尚无进度时从min_delay开始指数退避，所有延迟限制在 [min_delay, max_delay] 并带随机抖动。
+    """
+
+    def __init__(self, min_delay: float = 30.0, max_delay: float = 1800.0, backoff: float = 2.0, jitter: float = 0.1):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.jitter = jitter
+        self.poll_calls = 0
+
+    def next_delay(self, elapsed: float, completed: int, total: int, attempt: int) -> float:
+        """
+        Args:
+            elapsed: Batch自创建起已经过的秒数
+            completed: 已处理（成功+失败）的请求数
+            total: 请求总数
+            attempt: 本次轮询之前已轮询的次数
+        """
+        if completed > 0 and total > completed and elapsed > 0:
+            rate = completed / elapsed
+            delay = (total - completed) / rate
+        else:
+            delay = self.min_delay * self.backoff ** attempt
+        delay = min(max(delay, self.min_delay), self.max_delay)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def record_poll(self):
+        self.poll_calls += 1
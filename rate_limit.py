@@ -0,0 +1,238 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+# 智谱API的限流错误码：1302 并发数过高，1303 频率过高，1305 访问量过大
+THROTTLE_ERROR_CODES = ("1302", "1303", "1305")
+
+
+# 仍被限流的请求最终失败时错误信息中的标记
+THROTTLED_MESSAGE = "仍被限流"
+
+
+def error_code(error) -> Optional[str]:
+    """异常中的结构化错误码（异常的code属性或回复体中的error.code），没有时返回None"""
+    code = getattr(error, "code", None)
+    if code is None:
+        response = getattr(error, "response", None)
+        try:
+            code = response.json()["error"]["code"]
+        except Exception:
+            return None
+    return str(code) if code is not None else None
+
+
+def is_throttle_error(error) -> bool:
+    """判断异常是否为限流（HTTP 429或限流错误码），只看状态码和结构化错误码，不匹配错误信息文本"""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    return error_code(error) in THROTTLE_ERROR_CODES
+
+
+def is_server_error(error) -> bool:
+    """判断异常是否为服务端错误（5xx），单条请求本身的4xx错误和本地的网络、解析异常不计入"""
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and status >= 500
+
+
+class TokenBucket:
+    """线程安全的令牌桶，rate为每秒补充的令牌数，capacity为允许的突发量"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """预约一个令牌，返回调用方需要等待的秒数（令牌不足时允许透支，由等待时间偿还）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def drain(self, seconds: float):
+        """清空令牌并额外暂停seconds秒，用于收到限流后整体退让"""
+        with self._lock:
+            self._tokens = min(self._tokens, 0) - seconds * self.rate
+            self._updated = time.monotonic()
+
+
+class AIMDController:
+    """
+    加性增/乘性减（AIMD）并发控制
+
+    并发名额用满时，每次成功且延迟正常的请求使并发上限增加 increase/limit（约每轮增加increase）；
+    名额未用满时不增加，避免上限脱离实际负载无限增长。
+    限流比例或服务端错误比例（按请求计的EWMA）超过阈值，
+    或名额用满时短期平均延迟超过长期基线的latency_tolerance倍（且至少高出latency_slack秒）时乘以decrease，
+    cooldown秒内最多下调一次，避免一批同时失败的请求把并发压到底。偶发的单个限流或错误不触发下调。
+    """
+
+    def __init__(self, initial: float = 20, min_limit: float = 1, max_limit: float = 64, increase: float = 1.0,
+                 decrease: float = 0.5, latency_tolerance: float = 2.0, latency_slack: float = 0.1,
+                 cooldown: float = 1.0, throttle_threshold: float = 0.2, error_threshold: float = 0.2,
+                 rate_alpha: float = 0.05):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.latency_slack = latency_slack
+        self.cooldown = cooldown
+        self.throttle_threshold = throttle_threshold
+        self.error_threshold = error_threshold
+        self.rate_alpha = rate_alpha
+        self.throttle_rate = 0.0  # 限流比例的EWMA
+        self.error_rate = 0.0  # 非限流请求中服务端错误比例的EWMA
+        self.recent_latency = None  # 短期平均延迟（EWMA，alpha=0.1）
+        self.baseline_latency = None  # 长期基线延迟（EWMA，alpha=0.01）
+        self.throttled = 0
+        self.errors = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float = None, error: bool = False, throttled: bool = False, saturated: bool = True) -> bool:
+        """记录一次请求结果，saturated表示当前并发名额是否已用满，返回是否触发了下调"""
+        with self._lock:
+            slow = False
+            if latency is not None and not error and not throttled:
+                if self.baseline_latency is None:
+                    self.recent_latency = self.baseline_latency = latency
+                else:
+                    self.recent_latency += (latency - self.recent_latency) * 0.1
+                    self.baseline_latency += (latency - self.baseline_latency) * 0.01
+                # 名额未用满时延迟升高与本地并发无关，不据此下调
+                slow = (saturated and self.recent_latency > self.baseline_latency * self.latency_tolerance
+                        and self.recent_latency - self.baseline_latency > self.latency_slack)
+            self.throttled += throttled
+            self.errors += error
+            self.throttle_rate += (throttled - self.throttle_rate) * self.rate_alpha
+            if not throttled:
+                self.error_rate += (error - self.error_rate) * self.rate_alpha
+            overloaded = throttled and self.throttle_rate > self.throttle_threshold
+            unhealthy = error and self.error_rate > self.error_threshold
+
+            if overloaded or unhealthy or slow:
+                now = time.monotonic()
+                if now - self._last_decrease < self.cooldown:
+                    return False
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                return True
+            if saturated and not error and not throttled:
+                self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            return False
+
+
+class AdaptiveLimiter:
+    """
+    GLMAPI各推理模式共享的自适应限流器
+
+    由AIMD控制的并发闸门（同时在途的请求/任务数）和令牌桶（请求速率）组成。
+    持续限流（限流比例超过阈值）时并发上限和令牌速率同时乘性下调并暂停发放令牌；之后速率按时间线性恢复，并发上限按成功请求加性恢复。
+    acquire/release（协程用acquire_async）管理并发名额，pace/pace_async在每次API调用前按令牌桶限速，
+    record记录每次API调用的耗时和结果。
+    """
+
+    def __init__(self, initial_concurrency: int = 20, min_concurrency: int = 1, max_concurrency: int = 64,
+                 rate: float = 100.0, min_rate: float = 1.0, max_rate: float = 500.0, rate_increase: float = 10.0,
+                 throttle_pause: float = 1.0):
+        """
+        Args:
+            initial_concurrency: 初始并发上限
+            min_concurrency: 并发上限的下限
+            max_concurrency: 并发上限的上限
+            rate: 初始请求速率（次/秒），提交、轮询和HTTP调用共用
+            min_rate: 速率下限
+            max_rate: 速率上限
+            rate_increase: 速率每秒恢复的量（次/秒）
+            throttle_pause: 收到限流并下调后暂停发放令牌的秒数
+        """
+        self.controller = AIMDController(initial_concurrency, min_concurrency, max_concurrency)
+        self.bucket = TokenBucket(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate_increase = rate_increase
+        self.throttle_pause = throttle_pause
+        self._rate_updated = time.monotonic()
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    @property
+    def max_concurrency(self) -> int:
+        return int(self.controller.max_limit)
+
+    @property
+    def concurrency(self) -> int:
+        """当前并发上限"""
+        return max(int(self.controller.limit), 1)
+
+    def try_acquire(self) -> bool:
+        """不阻塞地占用一个并发名额"""
+        with self._cond:
+            if self.in_flight < self.concurrency:
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        """阻塞直到获得并发名额"""
+        with self._cond:
+            while self.in_flight >= self.concurrency:
+                self._cond.wait()
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        """协程版acquire，等待期间不占用线程"""
+        while not self.try_acquire():
+            await asyncio.sleep(0.05)
+
+    def release(self):
+        """归还并发名额"""
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def pace(self):
+        """按令牌桶限速，每次API调用（提交、轮询、HTTP请求）前调用"""
+        wait = self.bucket.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def pace_async(self):
+        wait = self.bucket.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record(self, latency: float = None, error: bool = False, throttled: bool = False):
+        """记录一次调用结果，驱动并发上限和令牌速率的AIMD调整"""
+        saturated = self.in_flight >= self.concurrency
+        decreased = self.controller.record(latency, error, throttled, saturated)
+        now = time.monotonic()
+        if throttled and decreased:
+            self.bucket.drain(self.throttle_pause)
+            self.bucket.rate = max(self.min_rate, self.bucket.rate * self.controller.decrease)
+        elif not throttled:
+            self.bucket.rate = min(self.max_rate, self.bucket.rate + self.rate_increase * (now - self._rate_updated))
+        self._rate_updated = now
+        if decreased:
+            print(f"触发退让，并发上限降至 {self.concurrency}，速率 {self.bucket.rate:.1f}/s")
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "rate": round(self.bucket.rate, 2),
+            "in_flight": self.in_flight,
+            "throttled": self.controller.throttled,
+            "errors": self.controller.errors,
+            "throttle_rate": round(self.controller.throttle_rate, 4),
+            "error_rate": round(self.controller.error_rate, 4),
+        }
@@ -0,0 +1,61 @@
+from typing import Optional
+
+STATUS_SUCCESS = "success"
+STATUS_FAILED = "failed"
+STATUS_TIMEOUT = "timeout"
+
+
+class ItemResult:
+    """
+    单条输入的推理结果
+
+    status为success/failed/timeout；成功时content为模型回复，失败或超时时error为错误信息。
+    attempts为该条输入实际发出请求的轮数（缓存或运行日志命中时为0），
+    latency为最后一轮从提交到拿到结果的秒数（未知时为None）。
+    """
+
+    __slots__ = ("status", "content", "error", "attempts", "latency")
+
+    def __init__(self, status: str, content: Optional[str] = None, error: Optional[str] = None,
+                 attempts: int = 1, latency: Optional[float] = None):
+        self.status = status
+        self.content = content
+        self.error = error
+        self.attempts = attempts
+        self.latency = latency
+
+    @classmethod
+    def success(cls, content: str, latency: Optional[float] = None, attempts: int = 1) -> "ItemResult":
+        return cls(STATUS_SUCCESS, content=content, attempts=attempts, latency=latency)
+
+    @classmethod
+    def failure(cls, error: str, latency: Optional[float] = None) -> "ItemResult":
+        return cls(STATUS_FAILED, error=error, latency=latency)
+
+    @classmethod
+    def timeout(cls, error: str = "Task timeout", latency: Optional[float] = None) -> "ItemResult":
+        return cls(STATUS_TIMEOUT, error=error, latency=latency)
+
+    def copy(self) -> "ItemResult":
+        return ItemResult(self.status, self.content, self.error, self.attempts, self.latency)
+
+    @property
+    def ok(self) -> bool:
+        return self.status == STATUS_SUCCESS
+
+    @property
+    def text(self) -> str:
+        """成功时为回复内容，否则为错误信息"""
+        return self.content if self.ok else self.error
+
+    def to_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "content": self.content,
+            "error": self.error,
+            "attempts": self.attempts,
+            "latency": self.latency,
+        }
+
+    def __repr__(self):
+        return f"ItemResult({self.status!r}, content={self.content!r}, error={self.error!r}, attempts={self.attempts})"
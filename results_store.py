@@ -0,0 +1,170 @@
+import mmap
+import os
+import struct
+import threading
+from typing import Iterator, Optional, Tuple
+
+from utils import json_dumps_bytes, json_loads
+
+_SLOT = struct.Struct("<Q")
+
+
+def custom_id(index: int) -> str:
+    """条目下标对应的custom_id，与batch请求的编号方式一致"""
+    return f"request-{index}"
+
+
+class ResultsStore:
+    """
+    带偏移索引的结果存储
+
+    数据文件为追加写入的JSONL（每行一条记录，带index字段），索引文件（数据文件名加.idx）为按条目下标排列的
+    little-endian uint64数组，第i个槽位保存第i条记录在数据文件中的偏移+1（0表示尚无该条）。
+    写入顺序可以与下标无关（如按完成顺序），同一下标重复写入时索引指向最新的一行。
+    按下标或custom_id查询只需读一个槽位和一行，索引通过mmap访问，不需要把任何一个文件整体读入内存。
+    """
+
+    INDEX_SUFFIX = ".idx"
+
+    def __init__(self, path: str, readonly: bool = False):
+        """
+        Args:
+            path: 数据文件路径（.jsonl）
+            readonly: 只读打开，用于运行中或运行后查询结果
+        """
+        self.path = path
+        self.index_path = path + self.INDEX_SUFFIX
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        self._data = None
+        self._index = None
+        self._index_map: Optional[mmap.mmap] = None
+        if not readonly:
+            self._repair()
+            self._data = open(path, "ab")
+            self._index = open(self.index_path, "r+b" if os.path.exists(self.index_path) else "w+b")
+        self._reader = open(path, "rb") if os.path.exists(path) else None
+
+    def _repair(self):
+        """进程崩溃后：截掉数据文件末尾写了一半的行，索引缺失时由数据文件重建"""
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        rebuild = not os.path.exists(self.index_path)
+        if size:
+            with open(self.path, "r+b") as f:
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    # 从末尾向前按块查找最后一个换行符
+                    end = size
+                    while end > 0:
+                        start = max(0, end - (1 << 16))
+                        f.seek(start)
+                        position = f.read(end - start).rfind(b"\n")
+                        if position >= 0:
+                            end = start + position + 1
+                            break
+                        end = start
+                    f.truncate(end)
+                    rebuild = True
+        if rebuild:
+            self.rebuild_index()
+
+    def rebuild_index(self):
+        """顺序扫描数据文件重建索引"""
+        with open(self.index_path, "wb") as index:
+            for offset, record in self._scan():
+                index.seek(record["index"] * _SLOT.size)
+                index.write(_SLOT.pack(offset + 1))
+
+    def append(self, index: int, record: dict):
+        """写入第index条记录（会加入index字段），写完数据行后再更新索引"""
+        assert not self.readonly, "ResultsStore以只读方式打开"
+        line = json_dumps_bytes({"index": index, **record}) + b"\n"
+        with self._lock:
+            offset = self._data.tell()
+            self._data.write(line)
+            self._data.flush()
+            self._index.seek(index * _SLOT.size)
+            self._index.write(_SLOT.pack(offset + 1))
+            self._index.flush()
+
+    def _offset(self, index: int) -> Optional[int]:
+        """从mmap的索引中读取第index条的偏移，索引文件增长后重新映射"""
+        position = index * _SLOT.size
+        if index < 0:
+            return None
+        if self._index_map is None or position + _SLOT.size > len(self._index_map):
+            if not os.path.exists(self.index_path) or os.path.getsize(self.index_path) < position + _SLOT.size:
+                return None
+            if self._index_map is not None:
+                self._index_map.close()
+            with open(self.index_path, "rb") as f:
+                self._index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        value = _SLOT.unpack_from(self._index_map, position)[0]
+        return value - 1 if value else None
+
+    def __contains__(self, index: int) -> bool:
+        with self._lock:
+            return self._offset(index) is not None
+
+    def get(self, index: int) -> Optional[dict]:
+        """第index条记录，不存在时返回None"""
+        with self._lock:
+            offset = self._offset(index)
+            if offset is None:
+                return None
+            if self._reader is None:
+                self._reader = open(self.path, "rb")
+            self._reader.seek(offset)
+            return json_loads(self._reader.readline())
+
+    def get_by_custom_id(self, custom_id_: str) -> Optional[dict]:
+        """按custom_id（request-<下标>）查询"""
+        prefix, _, number = custom_id_.rpartition("-")
+        if prefix != "request" or not number.isdigit():
+            return None
+        return self.get(int(number))
+
+    def count(self) -> int:
+        """已写入的条数（不同下标数）"""
+        if not os.path.exists(self.index_path):
+            return 0
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+        return sum(1 for (value,) in _SLOT.iter_unpack(data[:len(data) - len(data) % _SLOT.size]) if value)
+
+    def _scan(self) -> Iterator[Tuple[int, dict]]:
+        """通过mmap顺序扫描数据文件，产出 (偏移, 记录)"""
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset, size = 0, len(data)
+            while offset < size:
+                end = data.find(b"\n", offset)
+                if end < 0:
+                    break
+                if end > offset:
+                    yield offset, json_loads(data[offset:end])
+                offset = end + 1
+
+    def __iter__(self) -> Iterator[dict]:
+        """按写入顺序扫描全部记录；同一下标写入多次时只产出索引指向的最新一条"""
+        for offset, record in self._scan():
+            with self._lock:
+                latest = self._offset(record["index"])
+            if latest == offset:
+                yield record
+
+    def close(self):
+        with self._lock:
+            for f in (self._data, self._index, self._reader, self._index_map):
+                if f is not None:
+                    f.close()
+            self._data = self._index = self._reader = self._index_map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
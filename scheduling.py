@@ -0,0 +1,84 @@
+import math
+import threading
+from typing import List, Optional
+
+from instructions import RHETORIC_INSTRUCTION, SEGMENTATION_INSTRUCTION
+
+TASK_RHETORIC = "rhetoric"
+TASK_SEGMENTATION = "segmentation"
+
+
+def detect_task(item) -> Optional[str]:
+    """根据instruction判断任务类型（打包请求的instruction以原instruction开头），无法识别时返回None"""
+    instruction = item.get('instruction', '')
+    if instruction.startswith(RHETORIC_INSTRUCTION):
+        return TASK_RHETORIC
+    if instruction.startswith(SEGMENTATION_INSTRUCTION):
+        return TASK_SEGMENTATION
+    return None
+
+
+class TokenBudget:
+    """
+    按任务类型和输入长度估算每条请求的输出token数，用作max_tokens
+
+    - 修辞识别：回答为固定短句，使用rhetoric_tokens
+    - 分词：输出为输入句子加空格，按 输入字符数 * segmentation_ratio + margin 估算
+    - 其他任务：使用default_max_tokens
+    打包请求（packing.pack_items生成，带pack_size字段）的估算值按条数放大。
+    同时记录估算值与实际completion_tokens，用于评估预算是否合适。
+    注意：推理模型的思考过程同样计入max_tokens，使用前应关闭思考或放宽预算。
+    """
+
+    def __init__(self, default_max_tokens: int = 1024, rhetoric_tokens: int = 32, segmentation_ratio: float = 1.5,
+                 margin: int = 16, min_tokens: int = 16):
+        self.default_max_tokens = default_max_tokens
+        self.rhetoric_tokens = rhetoric_tokens
+        self.segmentation_ratio = segmentation_ratio
+        self.margin = margin
+        self.min_tokens = min_tokens
+        self._lock = threading.Lock()
+        self._n = 0
+        self._estimated = 0
+        self._actual = 0
+        self._truncated = 0
+        self._over = 0
+
+    def estimate(self, item) -> int:
+        """估算单条请求的max_tokens"""
+        task = detect_task(item)
+        pack_size = item.get('pack_size', 1)
+        if task == TASK_RHETORIC:
+            return self.rhetoric_tokens * pack_size
+        if task == TASK_SEGMENTATION:
+            estimate = math.ceil(len(item.get('input', '')) * self.segmentation_ratio) + self.margin * pack_size
+            return min(max(estimate, self.min_tokens), self.default_max_tokens * pack_size)
+        return self.default_max_tokens
+
+    def order_longest_first(self, items: List) -> List[int]:
+        """按估算输出长度从长到短排列的下标，长任务先发出以缩短整体运行的长尾"""
+        estimates = [self.estimate(item) for item in items]
+        return sorted(range(len(items)), key=lambda i: -estimates[i])
+
+    def record(self, estimated: int, completion_tokens: Optional[int], finish_reason: Optional[str] = None):
+        """记录一条请求的估算值与实际用量，finish_reason为length表示输出被max_tokens截断"""
+        if completion_tokens is None:
+            return
+        with self._lock:
+            self._n += 1
+            self._estimated += estimated
+            self._actual += completion_tokens
+            self._truncated += finish_reason == "length"
+            self._over += completion_tokens > estimated
+
+    def report(self) -> dict:
+        """估算与实际token用量的汇总"""
+        with self._lock:
+            return {
+                "requests": self._n,
+                "estimated_tokens": self._estimated,
+                "actual_tokens": self._actual,
+                "utilization": self._actual / self._estimated if self._estimated else 0.0,
+                "truncated": self._truncated,
+                "over_estimate": self._over,
+            }
@@ -0,0 +1,394 @@
+import contextlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Union
+
+from glm_api import GLMAPI
+from cache import ResponseCache
+from hedging import HedgePolicy
+from metrics import MetricsRecorder, RequestTrace, error_class
+from results import ItemResult
+from scheduling import TokenBudget
+
+# 工作进程消息类型
+_DONE = "done"
+_CRASH = "crash"
+
+
+def make_process(api: GLMAPI, mode: str, task_description: str = "", pack_size: int = 1
+                 ) -> Callable[[List[dict]], List[ItemResult]]:
+    """返回以mode推理一组数据的函数，pack_size大于1时每个请求打包多条输入"""
+    if mode == "batch":
+        process = lambda data: api.batch_process(infer_data=data, description=task_description)
+    elif mode == "async":
+        process = api.async_process
+    elif mode == "http":
+        process = api.http_process
+    else:
+        raise ValueError(f"Unsupported mode: {mode}")
+    if pack_size > 1:
+        packed = process
+        process = lambda data: api.packed_process(data, packed, pack_size)
+    return process
+
+
+class _ForwardingRecorder(MetricsRecorder):
+    """工作进程中的请求指标：不写trace文件，已结束的请求记录随块结果发回主进程汇总"""
+
+    def __init__(self):
+        super().__init__()
+        self._finished = []
+
+    def add(self, trace: RequestTrace):
+        super().add(trace)
+        with self._lock:
+            self._finished.append(trace.to_dict())
+
+    def drain(self) -> List[dict]:
+        """取出上次调用以来结束的请求记录"""
+        with self._lock:
+            finished, self._finished = self._finished, []
+        return finished
+
+
+def _shard_worker(shard_no: int, spec: dict, options: dict, inbox, outbox):
+    """
+    工作进程：使用自己的API key、客户端和限流器，同时处理最多chunks_in_flight个数据块
+
+    inbox接收 (块编号, 数据) 或 None（退出），每块完成后向outbox发送 (_DONE, 分片编号, 块编号, 结果, 统计)。
+    token预算和请求对冲按options在每个进程中各自创建；启用指标时统计中带有本进程新结束的请求记录。
+    """
+    cache = ResponseCache(options["cache_path"]) if options.get("cache_path") else None
+    metrics = _ForwardingRecorder() if options.get("metrics") else None
+    client_kwargs = {
+        "api_key": spec["api_key"],
+        "model": spec.get("model", options["model"]),
+        "cache": cache,
+        "token_budget": TokenBudget() if options.get("token_budget") else None,
+        "metrics": metrics,
+        "hedging": HedgePolicy(options["hedge"], options["hedge_budget"]) if options.get("hedge") else None,
+    }
+    if spec.get("api_base"):
+        client_kwargs["api_base"] = spec["api_base"]
+    api = GLMAPI(**client_kwargs)
+    process = make_process(api, options["mode"], options["task_description"], options["pack_size"])
+    reported = {"throttled": 0}
+    lock = threading.Lock()
+
+    def run_chunk(chunk_id: int, data: List[dict]):
+        start = time.time()
+        try:
+            results = process(data)
+        except Exception as e:
+            results = [ItemResult.failure(f"Shard Error: {e}") for _ in data]
+        limiter = api.limiter.stats()
+        with lock:
+            # 限流器内部重试掉的429也计入，反映该key的配额压力
+            throttled = max(limiter["throttled"] - reported["throttled"],
+                            sum(error_class(result) == "throttled" for result in results))
+            reported["throttled"] = limiter["throttled"]
+        stats = {
+            "seconds": time.time() - start,
+            "throttled": throttled,
+            "limiter": limiter,
+            "traces": metrics.drain() if metrics is not None else [],
+            "token_budget": api.token_budget.report() if api.token_budget is not None else None,
+            "hedging": api.hedging.stats() if api.hedging is not None else None,
+        }
+        outbox.put((_DONE, shard_no, chunk_id, [result.to_dict() for result in results], stats))
+
+    devnull = open(os.devnull, "w")
+    try:
+        with contextlib.redirect_stdout(devnull) if not options.get("verbose") else contextlib.nullcontext():
+            with ThreadPoolExecutor(max_workers=options["chunks_in_flight"]) as executor:
+                while True:
+                    task = inbox.get()
+                    if task is None:
+                        break
+                    executor.submit(run_chunk, *task)
+    except Exception as e:
+        outbox.put((_CRASH, shard_no, None, str(e), None))
+    finally:
+        devnull.close()
+        api.close()
+        if cache is not None:
+            cache.close()
+
+
+class _Shard:
+    """主进程中记录的单个工作进程状态"""
+
+    def __init__(self, shard_no: int, spec: dict, process, inbox):
+        self.shard_no = shard_no
+        self.spec = spec
+        self.process = process
+        self.inbox = inbox
+        self.outstanding: Dict[int, List[int]] = {}  # 块编号 -> 输入下标
+        self.dispatched: Dict[int, float] = {}  # 块编号 -> 分派时刻
+        self.cooldown_until = 0.0
+        self.strikes = 0  # 连续被限流的块数
+        self.alive = True
+        self.items = 0
+        self.chunks = 0
+        self.failed = 0
+        self.throttled = 0
+        self.busy_seconds = 0.0
+        self.limiter = {}
+        self.token_budget = None
+        self.hedging = None
+
+    def available(self, now: float) -> bool:
+        return self.alive and now >= self.cooldown_until
+
+    def stats(self) -> dict:
+        key = self.spec["api_key"]
+        return {
+            "key": f"{key[:4]}...{key[-4:]}" if len(key) > 8 else key,
+            "api_base": self.spec.get("api_base"),
+            "items": self.items,
+            "chunks": self.chunks,
+            "failed": self.failed,
+            "throttled": self.throttled,
+            "items_per_sec": round(self.items / self.busy_seconds, 2) if self.busy_seconds else None,
+            "alive": self.alive,
+            "limiter": self.limiter,
+            **({"token_budget": self.token_budget} if self.token_budget is not None else {}),
+            **({"hedging": self.hedging} if self.hedging is not None else {}),
+        }
+
+
+class ShardedRunner:
+    """
+    多API key、多进程的分片推理
+
+    每个API key（可另配api_base和model）对应一个工作进程，各自持有GLMAPI客户端和自适应限流器，
+    JSON解析等工作也在各进程中完成。数据按chunk_size切块，由主进程按需分派：
+    - 每个进程最多同时处理chunks_in_flight个块，处理得快的key自然分到更多的块
+    - 一个块中被限流的比例达到throttle_threshold时，该key暂停接收新块 cooldown * 2**(连续次数-1) 秒
+    - 失败或超时的条目优先交给其他key重试（其他key都没有空闲名额时仍由原key重试），每条最多共尝试max_attempts轮
+    - 待分派数据用完（或只剩需避开该key的条目）后，耗时超过块平均耗时hedge_after倍的块会复制一份给空闲的key，先返回的结果生效
+    - 进程异常退出时，其未完成的块重新分派给其他进程
+    结果按输入顺序合并。各进程可共享同一个SQLite响应缓存（cache_path），中断后重跑时已完成的请求直接命中缓存。
+    token预算和请求对冲在各进程中分别生效，统计见stats()；各进程的请求记录汇总到主进程的metrics中。
+    """
+
+    def __init__(self, keys: List[Union[str, dict]], model: str = "glm-4-plus", mode: str = "http",
+                 task_description: str = "", pack_size: int = 1, cache_path: Optional[str] = None,
+                 chunk_size: int = 32, chunks_in_flight: int = 2, max_attempts: int = 3,
+                 throttle_threshold: float = 0.2, cooldown: float = 10.0, hedge_after: Optional[float] = 2.0,
+                 token_budget: bool = False, hedge: Optional[float] = None, hedge_budget: float = 0.05,
+                 metrics: Optional[MetricsRecorder] = None, verbose: bool = False):
+        """
+        Args:
+            keys: API key列表，元素为key字符串或 {"api_key", "api_base", "model"} 字典
+            model: 未单独指定model的key使用的模型
+            mode: 各进程使用的推理模式，batch/async/http
+            task_description: Batch任务描述
+            pack_size: 大于1时每个请求打包多条输入
+            cache_path: 各进程共享的响应缓存路径，None表示不使用缓存
+            chunk_size: 每次分派给进程的条数
+            chunks_in_flight: 每个进程同时处理的块数
+            max_attempts: 每条输入最多尝试的轮数
+            throttle_threshold: 块中被限流（含限流器内部重试）次数与条数之比达到该值时暂停该key
+            cooldown: 暂停的基础秒数，连续被限流时加倍
+            hedge_after: 收尾阶段复制慢块的耗时阈值（块平均耗时的倍数），None表示不复制
+            token_budget: 是否在各进程中按任务类型和输入长度设置max_tokens（见scheduling.TokenBudget）
+            hedge: 各进程中请求对冲的耗时分位数（见hedging.HedgePolicy），None表示不对冲
+            hedge_budget: 对冲请求数占请求总数的上限比例
+            metrics: 汇总各进程请求记录的指标采集器，None表示不记录
+            verbose: 是否输出工作进程中GLMAPI的运行日志
+        """
+        assert keys, "至少需要一个API key"
+        self.specs = [{"api_key": key} if isinstance(key, str) else dict(key) for key in keys]
+        self.options = {
+            "model": model,
+            "mode": mode,
+            "task_description": task_description,
+            "pack_size": pack_size,
+            "cache_path": cache_path,
+            "chunks_in_flight": chunks_in_flight,
+            "token_budget": token_budget,
+            "hedge": hedge,
+            "hedge_budget": hedge_budget,
+            "metrics": metrics is not None,
+            "verbose": verbose,
+        }
+        self.metrics = metrics
+        self.chunk_size = chunk_size
+        self.chunks_in_flight = chunks_in_flight
+        self.max_attempts = max_attempts
+        self.throttle_threshold = throttle_threshold
+        self.cooldown = cooldown
+        self.hedge_after = hedge_after
+        self.shards: List[_Shard] = []
+
+    def run(self, infer_data: List[dict]) -> List[ItemResult]:
+        """分片推理infer_data，结果按输入顺序返回"""
+        total = len(infer_data)
+        results: List[Optional[ItemResult]] = [None] * total
+        attempts = [0] * total
+        avoid: List[Optional[int]] = [None] * total  # 重试时优先避开的分片
+        pending = deque(range(total))
+        chunk_ids = iter(range(1 << 62))
+        hedged = set()  # 已复制过的块
+        finished = 0
+
+        context = multiprocessing.get_context("spawn")
+        outbox = context.Queue()
+        self.shards = []
+        for shard_no, spec in enumerate(self.specs):
+            inbox = context.Queue()
+            process = context.Process(target=_shard_worker, args=(shard_no, spec, self.options, inbox, outbox), daemon=True)
+            process.start()
+            self.shards.append(_Shard(shard_no, spec, process, inbox))
+        print(f"分片推理：{total} 条数据，{len(self.shards)} 个key，每块 {self.chunk_size} 条")
+
+        def take(shard: _Shard, now: float) -> List[int]:
+            """取出分给shard的下一块：其他分片有空闲名额时跳过需避开该分片的条目，否则不再避开"""
+            others_free = any(
+                s.available(now) and len(s.outstanding) < self.chunks_in_flight for s in self.shards if s is not shard
+            )
+            chunk, skipped = [], []
+            while pending and len(chunk) < self.chunk_size:
+                idx = pending.popleft()
+                if results[idx] is not None:
+                    # 已由复制的块完成
+                    continue
+                if avoid[idx] == shard.shard_no and others_free:
+                    skipped.append(idx)
+                else:
+                    chunk.append(idx)
+            pending.extendleft(reversed(skipped))
+            return chunk
+
+        def send(shard: _Shard, chunk: List[int]):
+            chunk_id = next(chunk_ids)
+            shard.outstanding[chunk_id] = chunk
+            shard.dispatched[chunk_id] = time.time()
+            shard.inbox.put((chunk_id, [infer_data[i] for i in chunk]))
+            return chunk_id
+
+        def straggler(shard: _Shard, now: float) -> Optional[List[int]]:
+            """收尾阶段从其他分片中找出耗时最长且超过阈值的未复制块"""
+            chunks = sum(s.chunks for s in self.shards)
+            if self.hedge_after is None or not chunks:
+                return None
+            threshold = self.hedge_after * sum(s.busy_seconds for s in self.shards) / chunks
+            candidates = [
+                (s.dispatched[chunk_id], chunk_id, idxs)
+                for s in self.shards if s is not shard
+                for chunk_id, idxs in s.outstanding.items()
+                if chunk_id not in hedged and now - s.dispatched[chunk_id] > threshold
+            ]
+            if not candidates:
+                return None
+            _, chunk_id, idxs = min(candidates)
+            hedged.add(chunk_id)
+            return [idx for idx in idxs if results[idx] is None] or None
+
+        def dispatch():
+            now = time.time()
+            for shard in self.shards:
+                while shard.available(now) and len(shard.outstanding) < self.chunks_in_flight:
+                    chunk = take(shard, now) if pending else None
+                    if not chunk:
+                        # 待分派数据用完或只剩需避开该分片的条目时，复制其他分片的慢块
+                        chunk = straggler(shard, now)
+                        if chunk:
+                            hedged.add(send(shard, chunk))
+                            print(f"分片{shard.shard_no}复制处理一个慢块（{len(chunk)} 条）")
+                            continue
+                    if not chunk:
+                        break
+                    send(shard, chunk)
+
+        def complete(shard: _Shard, idxs: List[int], chunk_results: List[ItemResult], stats: dict):
+            nonlocal finished
+            shard.chunks += 1
+            shard.items += len(idxs)
+            shard.busy_seconds += stats["seconds"]
+            shard.throttled += stats["throttled"]
+            shard.limiter = stats["limiter"]
+            shard.token_budget = stats["token_budget"]
+            shard.hedging = stats["hedging"]
+            if stats["throttled"] >= self.throttle_threshold * len(idxs):
+                shard.strikes += 1
+                delay = self.cooldown * 2 ** (shard.strikes - 1)
+                shard.cooldown_until = time.time() + delay
+                print(f"分片{shard.shard_no}被限流 {stats['throttled']}/{len(idxs)} 条，暂停 {delay:.0f} 秒")
+            else:
+                shard.strikes = 0
+            for idx, result in zip(idxs, chunk_results):
+                if results[idx] is not None:
+                    # 复制的块已先返回
+                    continue
+                attempts[idx] += max(result.attempts, 1)
+                result.attempts = attempts[idx]
+                if result.ok or attempts[idx] >= self.max_attempts:
+                    results[idx] = result
+                    finished += 1
+                else:
+                    shard.failed += 1
+                    avoid[idx] = shard.shard_no
+                    pending.append(idx)
+
+        def reclaim(shard: _Shard, reason: str):
+            """分片进程退出时，把其未完成的块放回待分派队列"""
+            shard.alive = False
+            lost = [idx for idxs in shard.outstanding.values() for idx in idxs if results[idx] is None]
+            shard.outstanding.clear()
+            shard.dispatched.clear()
+            pending.extendleft(reversed(lost))
+            print(f"分片{shard.shard_no}已退出（{reason}），{len(lost)} 条数据重新分派")
+
+        try:
+            dispatch()
+            while finished < total:
+                if not any(shard.alive for shard in self.shards):
+                    for idx in pending:
+                        results[idx] = ItemResult.failure("Shard Error: 所有分片进程都已退出")
+                    break
+                try:
+                    kind, shard_no, chunk_id, payload, stats = outbox.get(timeout=1.0)
+                except queue.Empty:
+                    for shard in self.shards:
+                        if shard.alive and not shard.process.is_alive():
+                            reclaim(shard, f"exitcode={shard.process.exitcode}")
+                    dispatch()
+                    continue
+                shard = self.shards[shard_no]
+                if kind == _DONE and self.metrics is not None:
+                    # 复制的块落后返回时其请求也已实际发出，同样计入指标
+                    for trace in stats["traces"]:
+                        self.metrics.add(RequestTrace.from_dict(trace))
+                if kind == _CRASH:
+                    reclaim(shard, payload)
+                elif chunk_id in shard.outstanding:
+                    idxs = shard.outstanding.pop(chunk_id)
+                    del shard.dispatched[chunk_id]
+                    complete(shard, idxs, [ItemResult(**result) for result in payload], stats)
+                    print(f"已完成 {finished}/{total}，分片{shard_no}: {shard.limiter}")
+                dispatch()
+        finally:
+            for shard in self.shards:
+                if shard.outstanding:
+                    # 剩余的块已由其他分片完成或已放弃，不再等待
+                    shard.process.terminate()
+                elif shard.process.is_alive():
+                    shard.inbox.put(None)
+            for shard in self.shards:
+                shard.process.join(timeout=30)
+                if shard.process.is_alive():
+                    shard.process.terminate()
+
+        print(f"分片推理完成：{self.stats()}")
+        return results
+
+    def stats(self) -> List[dict]:
+        """各分片处理的条数、失败和被限流次数以及吞吐"""
+        return [shard.stats() for shard in self.shards]
@@ -0,0 +1,41 @@
+from typing import Iterable, Iterator, Union
+
+from packing import parse_packed_reply
+from scheduling import TASK_RHETORIC, detect_task
+from utils import json_loads
+
+# 修辞识别回答的判定词，回答以其中之一开头即可确定标签
+RHETORIC_LABELS = ("是", "否")
+
+
+def iter_sse_events(lines: Iterable[Union[bytes, str]]) -> Iterator[dict]:
+    """逐行解析流式接口返回的server-sent events，产出每个data事件的JSON，遇到[DONE]结束"""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.startswith("data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            return
+        if payload:
+            yield json_loads(payload)
+
+
+def _label_decided(text: str) -> bool:
+    return text.lstrip(" \n\"'“「").startswith(RHETORIC_LABELS)
+
+
+def stop_on_rhetoric_label(item: dict, text: str) -> bool:
+    """
+    流式输出的提前停止条件：修辞识别任务的回答一旦以“是”或“否”开头即可停止
+
+    打包请求在每个编号的回答都已确定标签后停止；其他任务从不提前停止。
+    """
+    if detect_task(item) != TASK_RHETORIC:
+        return False
+    pack_size = item.get('pack_size')
+    if pack_size is None:
+        return _label_decided(text)
+    answers = parse_packed_reply(text, pack_size)
+    return len(answers) == pack_size and all(_label_decided(answer) for answer in answers.values())
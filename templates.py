@@ -0,0 +1,91 @@
+import hashlib
+import threading
+from typing import Dict, List, Tuple
+
+from utils import json_dumps_bytes
+
+
+class CompiledTemplate:
+    """
+    同一模型、system和instruction的预编译请求模板
+
+    请求体中 model、system消息和instruction 组成的常量前缀只编码一次，每条请求只需转义input并拼接，
+    所有请求的前缀字节完全一致，便于服务端的前缀缓存命中。请求体布局：
+    {"model":…,"messages":[{"role":"system","content":…},{"role":"user","content":"instruction\\n\\ninput"}],参数…}
+    """
+
+    def __init__(self, model: str, system: str, instruction: str):
+        self.model = model
+        self.system = system
+        self.instruction = instruction
+        self.system_message = {"role": "system", "content": system}
+        self.user_prefix = f"{instruction}\n\n"
+        # user消息的content编码后去掉结尾引号，之后直接拼接转义后的input
+        self.prefix = (
+            b'{"model":' + json_dumps_bytes(model)
+            + b',"messages":[' + json_dumps_bytes(self.system_message)
+            + b',{"role":"user","content":' + json_dumps_bytes(self.user_prefix)[:-1]
+        )
+        self._suffixes: Dict[Tuple, bytes] = {}
+        # 常量前缀的摘要只计算一次，每条请求的缓存键只需再哈希input和参数
+        self.digest = hashlib.sha256(self.prefix).digest()
+
+    def messages(self, input_text: str) -> List[Dict]:
+        """SDK调用使用的messages，各条请求共用同一个system消息对象"""
+        return [self.system_message, {"role": "user", "content": self.user_prefix + input_text}]
+
+    def request_key(self, input_text: str, params_key: bytes) -> str:
+        """
+        请求的内容寻址缓存键：前缀摘要、input和参数编码（cache.request_params_key）的sha256
+
+        前缀已包含model、system和instruction，因此键只由实际请求内容决定；input前写入长度以免与参数部分混淆。
+        """
+        data = input_text.encode("utf-8")
+        hasher = hashlib.sha256(self.digest)
+        hasher.update(len(data).to_bytes(8, "little"))
+        hasher.update(data)
+        hasher.update(params_key)
+        return hasher.hexdigest()
+
+    def _suffix(self, params: dict) -> bytes:
+        """请求参数部分的编码，按参数取值缓存"""
+        cache_key = tuple(params.items())
+        suffix = self._suffixes.get(cache_key)
+        if suffix is None:
+            suffix = b'"}]' + (b"," + json_dumps_bytes(params)[1:-1] if params else b"") + b"}"
+            self._suffixes[cache_key] = suffix
+        return suffix
+
+    def encode_body(self, input_text: str, **params) -> bytes:
+        """编码chat/completions请求体，params为temperature、max_tokens等参数，值为None的参数不发送"""
+        params = {name: value for name, value in params.items() if value is not None}
+        return self.prefix + json_dumps_bytes(input_text)[1:-1] + self._suffix(params)
+
+    def encode_batch_line(self, custom_id: str, input_text: str, **params) -> bytes:
+        """编码batch文件中的一行（含换行符）"""
+        return (b'{"custom_id":' + json_dumps_bytes(custom_id)
+                + b',"method":"POST","url":"/v4/chat/completions","body":'
+                + self.encode_body(input_text, **params) + b"}\n")
+
+
+class TemplateCache:
+    """按 (model, system, instruction) 缓存CompiledTemplate，整个数据集通常只编译一次"""
+
+    def __init__(self):
+        self._templates: Dict[Tuple[str, str, str], CompiledTemplate] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model: str, item) -> CompiledTemplate:
+        """item为数据集中的一条记录（dict或DatasetRecord）"""
+        key = (model, item.get('system', ''), item.get('instruction', ''))
+        template = self._templates.get(key)
+        if template is None:
+            with self._lock:
+                template = self._templates.get(key)
+                if template is None:
+                    template = self._templates[key] = CompiledTemplate(*key)
+        return template
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
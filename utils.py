@@ -1,10 +1,74 @@
 import json
 import os
 
-from tqdm import tqdm
-import yaml
+# Optional fast JSON backends, in order of preference; stdlib json is the fallback.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
 
+def json_dumps(obj, indent: int = None) -> str:
+    """
+    Serializes obj to a JSON string without escaping non-ASCII characters.
+    Uses orjson or ujson for compact output when available; indented output always uses stdlib json
+    so that the layout of existing files is unchanged. Objects the fast backend rejects (such as integers
+    beyond 64 bits) fall back to stdlib json, so anything stdlib json accepts still serializes.
+    Args:
+        obj: The object to serialize.
+        indent (int): Indentation width, or None for compact single-line output.
+    Returns:
+        str: The JSON string.
+    """
+    if indent is None:
+        try:
+            if orjson is not None:
+                return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+            if ujson is not None:
+                return ujson.dumps(obj, ensure_ascii=False)
+        except (TypeError, ValueError, OverflowError):
+            pass
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(obj, ensure_ascii=False, indent=indent)
+
+def json_dumps_bytes(obj) -> bytes:
+    """
+    Serializes obj to compact UTF-8 encoded JSON bytes without escaping non-ASCII characters.
+    orjson produces bytes directly, which avoids a str round trip when the result is written or sent as-is.
+    Args:
+        obj: The object to serialize.
+    Returns:
+        bytes: The encoded JSON document.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json_dumps(obj).encode("utf-8")
+
+def json_loads(data):
+    """
+    Parses a JSON document from str or bytes using the fastest available backend.
+    Documents the fast backend rejects but stdlib json accepts (such as NaN or Infinity) are parsed by stdlib json.
+    Args:
+        data (str or bytes): The JSON document.
+    Returns:
+        The parsed object.
+    """
+    try:
+        if orjson is not None:
+            return orjson.loads(data)
+        if ujson is not None:
+            return ujson.loads(data)
+    except ValueError:
+        pass
+    return json.loads(data)
+
 def load_json_file(file_path: str) -> dict:
     """
     Reads a JSON file and returns the data as a dictionary.
@@ -13,23 +77,96 @@ def load_json_file(file_path: str) -> dict:
     Returns:
         dict: A dictionary containing the data from the JSON file.
     """
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    with open(file_path, "rb") as f:
+        data = json_loads(f.read())
     return data
 
-def save_json_file(data, path: str):
+def save_json_file(data, path: str, compact: bool = False):
     """
     Saves the given data to a JSON file at the specified path.
     Args:
         data (dict or list): The data to be saved.
         path (str): The file path where the data should be saved.
+        compact (bool): Write compact single-line JSON (fast path) instead of indent=4.
     """
     if not path.lower().endswith(".json"):
         path = os.path.splitext(path)[0] + ".json"
     with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+        f.write(json_dumps(data, indent=None if compact else 4))
     print(f"Successfully saved data to {path}")
 
+def iter_json_array_file(file_path: str, chunk_size: int = 1 << 20):
+    """
+    Lazily yields the elements of a JSON file whose top-level value is an array,
+    reading the file in chunks so memory stays bounded by the largest single element.
+    Args:
+        file_path (str): The file path to the JSON file.
+        chunk_size (int): Number of characters read per chunk.
+    Yields:
+        The elements of the top-level array, in order.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, "r", encoding="utf-8") as f:
+        buf = f.read(chunk_size)
+        pos = 0
+        eof = not buf
+        started = False
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos == len(buf):
+                if eof:
+                    raise ValueError(f"Unexpected end of JSON array in {file_path}")
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+
+            ch = buf[pos]
+            if not started:
+                if ch != "[":
+                    raise ValueError(f"{file_path} does not contain a top-level JSON array")
+                started = True
+                pos += 1
+                continue
+            if ch == ",":
+                pos += 1
+                continue
+            if ch == "]":
+                return
+
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+                delim = end
+                while delim < len(buf) and buf[delim] in " \t\r\n":
+                    delim += 1
+            except json.JSONDecodeError:
+                delim = None
+            # An element is complete only once the following "," or "]" is in the buffer; otherwise it may
+            # have been cut at the chunk boundary (e.g. "7.5e" parses as 7.5), so read more and retry.
+            if delim is None or delim == len(buf) or buf[delim] not in ",]":
+                if eof:
+                    raise ValueError(f"Malformed JSON array element in {file_path} at offset {pos}")
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            yield obj
+            pos = delim
+
+def iter_jsonl_file(file_path: str):
+    """
+    Lazily yields the records of a JSONL file one line at a time; blank lines are skipped.
+    Args:
+        file_path (str): The file path to the JSONL file.
+    Yields:
+        dict: One parsed record per non-empty line.
+    """
+    with open(file_path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield json_loads(line)
+
 def load_jsonl_file(file_path: str) -> list:
     """
     Reads a JSONL file and returns the data as a list of dictionaries, with a progress bar.
@@ -38,26 +175,97 @@ def load_jsonl_file(file_path: str) -> list:
     Returns:
         list: A list of dictionaries containing the data from the JSONL file.
     """
-    data = []
-    with open(file_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-        total = len(lines)
-        for line in tqdm(lines, total=total, desc="Loading JSONL"):
-            data.append(json.loads(line.strip()))
-    return data
+    from tqdm import tqdm  # imported on first use to keep module import fast
+    return list(tqdm(iter_jsonl_file(file_path), desc="Loading JSONL"))
 
 def save_jsonl_file(data: list, path: str):
     """
     Saves the given data to a JSONL file at the specified path.
     Args:
-        data (list): The data to be saved.
+        data (list): The data to be saved. Any iterable of records is accepted.
         path (str): The file path where the data should be saved.
     """
-    with open(path, "w", encoding="utf-8") as f:
-        for item in data:
-            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    with JsonlWriter(path) as writer:
+        writer.write_many(data)
     print(f"Successfully saved data to {path}")
 
+class JsonlWriter:
+    """
+    Incremental JSONL writer: each record is serialized and written as soon as it is given,
+    so memory does not grow with the number of records.
+    Usage:
+        with JsonlWriter(path) as writer:
+            writer.write(record)
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        """
+        Args:
+            path (str): The file path to write to.
+            append (bool): Append to an existing file instead of truncating it.
+        """
+        self.path = path
+        self.count = 0
+        self._file = open(path, "a" if append else "w", encoding="utf-8")
+
+    def write(self, item):
+        self._file.write(json_dumps(item) + "\n")
+        self.count += 1
+
+    def write_many(self, items):
+        for item in items:
+            self.write(item)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class JsonArrayWriter:
+    """
+    Incremental writer for a JSON file holding a top-level array, one compact element per line.
+    The closing bracket is written on close(), so use it as a context manager.
+    Usage:
+        with JsonArrayWriter(path) as writer:
+            writer.write(record)
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): The file path to write to.
+        """
+        self.path = path
+        self.count = 0
+        self._file = open(path, "w", encoding="utf-8")
+        self._file.write("[")
+
+    def write(self, item):
+        self._file.write(("\n" if self.count == 0 else ",\n") + json_dumps(item))
+        self.count += 1
+
+    def write_many(self, items):
+        for item in items:
+            self.write(item)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.write("\n]\n" if self.count else "]\n")
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
 def save_tsv_file(data, path):
     """
     Saves the given data to a TSV file at the specified path.